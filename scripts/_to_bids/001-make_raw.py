@@ -1,8 +1,12 @@
-import mne
-import numpy as np
 import os.path as op
 import config
 import config_raw
+from _bad_channels import (get_bads_fname, read_bads, write_bads,
+                           find_bad_channels)
+from _parallel import run_parallel
+from _stream_raw import filter_concatenate_raws
+from _manifest import find_kit_file
+from _rebuild import is_stale, record
 
 
 drive = config.drive
@@ -11,47 +15,61 @@ reject = None
 exp = 'OLDT'
 redo = config.redo
 baseline = None
-subjects, experiments = zip(*config_raw.subjects.items())
+# in the headless mode, the bad channels are read from the sidecar files,
+# or detected if there are none.
+interactive = config.interactive
+n_jobs = 1 if interactive else config.n_jobs
+mem_limit = config.mem_limit
 
-for subject, experiments in config_raw.subjects.items()[3:]:
+
+def make_raw(subject, experiments):
     print(config.banner % subject)
 
     if exp == 'OLDT':
-        exps = [experiments[0], experiments[2]]
+        runs = [experiments[0], experiments[2]]
     else:
-        exps = [experiments[1]]
+        runs = [experiments[1]]
+    runs = [run for run in runs if run != 'n/a']
     path = config.drive
+    highpass, lowpass = (.51, 40)
+    filt = filt_type + '_hp%s_lp%s' % (highpass, lowpass)
     fname_raw = op.join(path, subject, 'mne',
-                        subject + '_%s_' % exp + 'calm_%s_filt-raw.fif')
+                        subject + '_%s_' % exp + 'calm_%s_filt-raw.fif' % filt)
+
+    fnames_kit = [find_kit_file(path, subject, run, role) for run in runs
+                  for role in ('con', 'mrk_pre', 'mrk_post', 'elp', 'hsp')]
+    fnames_bads = [get_bads_fname(path, subject, run) for run in runs]
+    params = dict(runs=runs, filt=filt)
+    inputs = fnames_kit + [fname for fname in fnames_bads if op.exists(fname)]
+    if not is_stale(fname_raw, inputs, params, force=redo):
+        return fname_raw
 
-    raw_fifs = list()
-    for exp in exps:
-        raw = config_raw.kit2fiff(subject=subject, exp=exp,
-                              path=path, preload=False)
-        raw_fifs.append(raw)
     raws = list()
-    # we need to go experiment by experiment since some of the channels where
-    # saturated
-    if exp == 'OLDT':
-        for ri, exp in zip(raw_fifs, exps):
-            ri.load_data()
-            ri.plot(block=True, duration=5, n_channels=10,
-                    highpass=None, lowpass=40)
-            print("%s: Bad Chs: %s" % (exp, ri.info['bads']))
-            ri.interpolate_bads()
-            raws.append(ri)
-        raw = mne.concatenate_raws(raws)
-        del raws
-    else:
-        raw = raw_fifs[0]
-        raw.load_data()
-        raw.plot(block=True, duration=5, n_channels=10,
-                highpass=None, lowpass=40)
-        print("%s: Bad Chs: %s" % (exp, raw.info['bads']))
-        raw.interpolate_bads()
-
-    # bandpass filtering
-    highpass, lowpass = (.51, 40)
-    filt = filt_type + '_hp%s_lp%s' % (highpass, lowpass)
-    raw.filter(highpass, lowpass, method=filt_type)
-    raw.save(fname_raw % filt, overwrite=redo)
+    # we need to go run by run since some of the channels where saturated,
+    # the runs are only read block by block when filtering
+    for run, fname_bads in zip(runs, fnames_bads):
+        raw = config_raw.kit2fiff(subject=subject, exp=run,
+                                  path=path, preload=False)
+        bads = read_bads(fname_bads)
+        if bads is None and not interactive:
+            bads = find_bad_channels(raw)
+            write_bads(fname_bads, bads)
+        raw.info['bads'] = bads or list()
+        if interactive:
+            raw.plot(block=True, duration=5, n_channels=10,
+                     highpass=None, lowpass=40)
+            write_bads(fname_bads, raw.info['bads'])
+        print("%s: Bad Chs: %s" % (run, raw.info['bads']))
+        raws.append(raw)
+
+    # interpolate, concatenate and bandpass filter, block by block
+    filter_concatenate_raws(raws, fname_raw, highpass, lowpass,
+                            overwrite=True)
+    record(fname_raw, fnames_kit + fnames_bads, params)
+
+    return fname_raw
+
+
+if __name__ == '__main__':
+    run_parallel(make_raw, list(config_raw.subjects.items()),
+                 n_jobs=n_jobs, mem_limit=mem_limit)
@@ -16,11 +16,15 @@ import numpy as np
 import mne
 import config
 from _recode_events import _recode_events
+from _stim_steps import find_stim_steps_chunked
+from _trial_struct import make_trial_struct, write_trial_struct
+from _rebuild import is_stale, record
 
 redo = config.redo
 path = config.drive
 exp = config.exp
 filt = config.filt
+params = dict(exp=exp, merge=-2)
 
 
 for subject in config.subjects:
@@ -30,13 +34,12 @@ for subject in config.subjects:
     fname_evts = fname_template + '-events.tsv'
     fname_raw = fname_template + '_calm_' + filt + '_filt-raw.fif'
     # write the co-registration file
-    fname_trial = fname_template + '_meg_trial_struct.txt'
-
-    if not op.exists(fname_evts) or redo:
-        raw = mne.io.read_raw_fif(fname_raw)
+    fname_trial = fname_template + '_meg_trial_struct.npz'
 
+    if is_stale([fname_evts, fname_trial], [fname_raw], params, force=redo):
         # E-MEG alignment
-        evts = mne.find_stim_steps(raw, merge=-2)
+        # only the stim channel is read, chunk by chunk
+        evts = find_stim_steps_chunked(fname_raw, merge=-2)
         # select non-zero events
         idx = np.nonzero(evts[:, 2])[0]
         evts = evts[idx]
@@ -62,29 +65,10 @@ for subject in config.subjects:
         """
 
         idx = np.hstack((fix_idx, primes_idx, targets_idx))
-        evts = evts[idx]
-        idx = zip(evts[:, 0], np.arange(evts.size))
-        idx = list(zip(*sorted(idx))[-1])
-        evts = evts[idx]
-        coreg_evts = list()
-
-        with open(fname_trial, 'w') as FILE:
-            header = ['trial', 'i_start', 'old_trigger', 'trigger']
-            FILE.write(','.join(header) + '\n')
-            ii = -1
-            for evt in evts:
-                i_start, prev_trig, trig, new = evt
-                # at the start of the Experiment, the trigger reset to zero.
-                # starting trial at 0
-                if prev_trig == 255:
-                    continue
-                elif prev_trig == 0:
-                    ii += 1
-                coreg_evts.append(evt)
-                trial = [ii, i_start, trig, new]
-                trial = ','.join(map(str, trial)) + '\n'
-                FILE.write(trial)
+        trial_struct, evts = make_trial_struct(evts[idx])
+        write_trial_struct(fname_trial, trial_struct)
         # coreg event list
-        evts = np.array(coreg_evts)[:, [0, 1, -1]]
+        evts = evts[:, [0, 1, -1]]
 
         mne.write_events(fname_evts, evts)
+        record([fname_evts, fname_trial], [fname_raw], params)
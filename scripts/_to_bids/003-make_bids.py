@@ -1,14 +1,18 @@
+import os
 import os.path as op
-import numpy as np
-import shutil as sh
+import shutil
+from glob import glob
 
 from mne import read_events
 from mne.io import read_raw_fif
 from mne_bids import (write_raw_bids, make_bids_basename,
-                      make_bids_folders, make_dataset_description)
+                      make_dataset_description)
 
 import config
 import config_raw
+from _bids_io import link_or_copy, move_subject
+from _parallel import run_parallel
+from _rebuild import is_stale, record
 
 
 filt_type = config.filt[:3]
@@ -16,50 +20,112 @@ reject = None
 exp = config.exp
 event_id = config.event_id
 project_name = config.project_name
+redo = config.redo
+n_jobs = config.n_jobs
+mem_limit = config.mem_limit
 
 input_path = config.drives['home']
 output_path = op.join(config.drives['home'], '..', '..', project_name)
+# each subject is written to its own staging root, so that the workers do
+# not race on the `participants.tsv`, then moved into the BIDS root
+staging_path = op.join(output_path, '.staging')
 
-# meg.
-for subject in config_raw.subjects.keys():
-    print(config.banner % subject)
 
+def get_meg_fnames(subject):
     fname_raw = op.join(input_path, subject, 'mne',
                         subject + '_%s_calm_iir_hp0.51_lp40_filt-raw.fif' % exp)
+    fname_evts = op.join(input_path, subject, 'mne',
+                         subject + '_%s-eve.txt' % exp)
+    return fname_raw, fname_evts
+
+
+def get_bids_fnames(subject):
+    # `write_raw_bids` splits the large recordings into `_split-01_meg.fif`,
+    # `_split-02_meg.fif`, ...: the files written, or the unsplit file
+    bids_basename = make_bids_basename(subject=subject, task=project_name)
+    path = op.join(output_path, 'sub-{}'.format(subject), 'meg')
+    fnames = sorted(glob(op.join(path, bids_basename + '_split-*_meg.fif')))
+    fname_bids = op.join(path, bids_basename + '_meg.fif')
+    if op.exists(fname_bids) or not fnames:
+        fnames.insert(0, fname_bids)
+    return fnames
+
+
+def export_meg(subject):
+    print(config.banner % subject)
+    fname_raw, fname_evts = get_meg_fnames(subject)
+    params = dict(event_id=event_id)
+    if not is_stale(get_bids_fnames(subject), [fname_raw, fname_evts], params,
+                    force=redo):
+        return False
 
     raw = read_raw_fif(fname_raw)
-    events_data = read_events(op.join(input_path, subject, 'mne',
-                              subject + '_%s-eve.txt' % exp))
+    events_data = read_events(fname_evts)
     bids_basename = make_bids_basename(subject=subject, task=project_name)
-    write_raw_bids(raw, bids_basename, output_path,
+    # drop what is left of an interrupted export
+    subject_staging = op.join(staging_path, subject)
+    if op.isdir(subject_staging):
+        shutil.rmtree(subject_staging)
+    write_raw_bids(raw, bids_basename, subject_staging,
                    event_id=event_id, events_data=events_data,
                    overwrite=True)
+    return True
+
 
 # eyetrack. note, the BEP for eyetracking isn't merged
 # but this is likely the naming convention for it
-for subject, experiments in config_raw.subjects.items():
+def export_eyetrack(subject, experiments):
     exps = experiments[0], experiments[2]
     subname = 'sub-{}'.format(subject)
+    hows = list()
     for ii, exp in enumerate(exps, 1):
         if exp != 'n/a':
             bids_basename = make_bids_basename(subject=subject,
-                                            run='{:02d}'.format(ii),
-                                            task=project_name)
-            bids_eyetrack = op.join(output_path, subname,
-                                    'eyetrack', bids_basename + '_eyetrack.edf')
+                                               run='{:02d}'.format(ii),
+                                               task=project_name)
+            bids_eyetrack = op.join(output_path, subname, 'eyetrack',
+                                    bids_basename + '_eyetrack.edf')
             input_fname = op.join(input_path, subject,
-                                'edf', '{}_{}.edf'.format(subject, exp))
-            make_bids_folders(subject=subject, kind='eyetrack',
-                            output_path=output_path)
-            sh.copyfile(input_fname, bids_eyetrack)
-
-# make a dataset description
-make_dataset_description(path=output_path, data_license='CC-BY',
-                         name=project_name,
-                         authors=['Teon L Brooks', 'Laura Gwilliams',
-                                  'Alexandre Gramfort', 'Alec Marantz'],
-                         how_to_acknowledge='',
-                         funding=['NSF DGE-1342536 (TB)',
-                                  'Abu  Dhabi  Institute Grant G1001 (AM)'],
-                         references_and_links='',
-                         doi='')
\ No newline at end of file
+                                  'edf', '{}_{}.edf'.format(subject, exp))
+            hows.append(link_or_copy(input_fname, bids_eyetrack))
+    return hows
+
+
+if __name__ == '__main__':
+    # meg.
+    subjects = [(subject,) for subject in config_raw.subjects.keys()]
+    exported = run_parallel(export_meg, subjects, n_jobs=n_jobs,
+                            mem_limit=mem_limit)
+    # only the main process touches the BIDS root
+    for subject, changed in sorted(exported.items()):
+        if changed:
+            # the previous export may have been split differently
+            for fname in get_bids_fnames(subject):
+                if op.exists(fname):
+                    os.remove(fname)
+            move_subject(op.join(staging_path, subject), output_path, subject)
+            fname_raw, fname_evts = get_meg_fnames(subject)
+            record(get_bids_fnames(subject), [fname_raw, fname_evts],
+                   dict(event_id=event_id))
+    # `move_subject` removes the staging root of each subject
+    if op.isdir(staging_path) and not os.listdir(staging_path):
+        os.rmdir(staging_path)
+    print('MEG: %d of %d subjects exported.'
+          % (sum(exported.values()), len(subjects)))
+
+    # eyetrack.
+    hows = run_parallel(export_eyetrack, list(config_raw.subjects.items()),
+                        n_jobs=n_jobs, mem_limit=mem_limit)
+    for subject, how in sorted(hows.items()):
+        print('%s eyetrack: %s' % (subject, ', '.join(how)))
+
+    # make a dataset description
+    make_dataset_description(path=output_path, data_license='CC-BY',
+                             name=project_name,
+                             authors=['Teon L Brooks', 'Laura Gwilliams',
+                                      'Alexandre Gramfort', 'Alec Marantz'],
+                             how_to_acknowledge='',
+                             funding=['NSF DGE-1342536 (TB)',
+                                      'Abu  Dhabi  Institute Grant G1001 (AM)'],
+                             references_and_links='',
+                             doi='')
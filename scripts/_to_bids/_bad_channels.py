@@ -0,0 +1,83 @@
+"""
+Bad Channels
+------------
+The bad channels of each run are kept in a sidecar file next to the KIT
+files, one channel name per line, so that the raw files can be made again
+without marking them by hand.
+
+When there is no sidecar, the bad channels can be detected from the data:
+flat channels have almost no variance and saturated channels sit at their
+extreme value for a large part of the recording.
+"""
+import os.path as op
+import numpy as np
+import mne
+
+
+def get_bads_fname(path, subject, exp):
+    return op.join(path, subject, 'kit', '%s_%s_bads.txt' % (subject, exp))
+
+
+def read_bads(fname):
+    """Read the bad channels from a sidecar file, None if there is none."""
+    if not op.exists(fname):
+        return None
+    with open(fname) as FILE:
+        bads = [line.strip() for line in FILE]
+    return [bad for bad in bads if bad and not bad.startswith('#')]
+
+
+def write_bads(fname, bads):
+    with open(fname, 'w') as FILE:
+        FILE.write(''.join(bad + '\n' for bad in bads))
+
+
+def find_bad_channels(raw, flat=1e-15, saturation=1e-3, rail=1e-3,
+                      chunk_duration=60.):
+    """Detect flat and saturated MEG channels.
+
+    Parameters
+    ----------
+    raw : instance of Raw
+        The raw data. It is read in chunks, so it need not be preloaded.
+    flat : float
+        Channels with a standard deviation below `flat` (in T) are bad.
+    saturation : float
+        Channels with more than this fraction of their samples on the rail
+        are bad.
+    rail : float
+        Samples within this fraction of the maximum absolute value of the
+        channel are considered on the rail.
+    chunk_duration : float
+        The duration of the chunks read, in seconds.
+
+    Returns
+    -------
+    bads : list of str
+        The bad channels.
+    """
+    picks = mne.pick_types(raw.info, meg=True, ref_meg=False, exclude=[])
+    n_chunk = max(int(round(chunk_duration * raw.info['sfreq'])), 1)
+    starts = range(0, raw.n_times, n_chunk)
+
+    # first pass: moments and the extreme value of each channel
+    sums = np.zeros(len(picks))
+    sums_sq = np.zeros(len(picks))
+    peaks = np.zeros(len(picks))
+    for start in starts:
+        data = raw.get_data(picks, start, start + n_chunk)
+        sums += data.sum(axis=1)
+        sums_sq += (data ** 2).sum(axis=1)
+        peaks = np.maximum(peaks, np.abs(data).max(axis=1))
+    means = sums / raw.n_times
+    stds = np.sqrt(np.maximum(sums_sq / raw.n_times - means ** 2, 0))
+
+    # second pass: how long each channel stays on the rail
+    n_rail = np.zeros(len(picks))
+    thresh = (1 - rail) * peaks[:, np.newaxis]
+    for start in starts:
+        data = raw.get_data(picks, start, start + n_chunk)
+        n_rail += (np.abs(data) >= thresh).sum(axis=1)
+
+    is_bad = (stds < flat) | (n_rail / raw.n_times > saturation)
+    return [raw.ch_names[pick] for pick in picks[is_bad]]
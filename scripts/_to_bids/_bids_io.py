@@ -0,0 +1,141 @@
+"""
+BIDS Export Helpers
+-------------------
+Copying the raw payloads into the BIDS tree duplicates tens of GB. When the
+source and the destination share a filesystem, the files are hard linked
+(or cloned, on filesystems that support it) instead. Otherwise, they are
+copied in chunks and the copy is verified against the checksum of the
+source. Files already exported and unchanged are left alone.
+"""
+import os
+import os.path as op
+import sys
+import shutil
+import hashlib
+import ctypes
+import ctypes.util
+
+from pandas import read_csv, concat
+
+
+def _same_file(src, dst):
+    if not op.exists(dst):
+        return False
+    src_stat, dst_stat = os.stat(src), os.stat(dst)
+    if (src_stat.st_dev, src_stat.st_ino) == (dst_stat.st_dev,
+                                              dst_stat.st_ino):
+        return True
+    # a previous copy keeps the size and mtime of its source
+    return (src_stat.st_size == dst_stat.st_size and
+            src_stat.st_mtime_ns == dst_stat.st_mtime_ns)
+
+
+def _reflink(src, dst):
+    """Clone a file, if the filesystem supports it."""
+    if sys.platform == 'darwin':
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if libc.clonefile(src.encode(), dst.encode(), 0) != 0:
+            raise OSError(ctypes.get_errno(), 'clonefile failed')
+    elif sys.platform.startswith('linux'):
+        import fcntl
+        FICLONE = 0x40049409
+        with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+            try:
+                fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+            except OSError:
+                fout.close()
+                os.remove(dst)
+                raise
+    else:
+        raise OSError('Cloning files is not supported on %s.' % sys.platform)
+
+
+def _copy_verified(src, dst, chunk_size):
+    h_src = hashlib.sha256()
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        for chunk in iter(lambda: fin.read(chunk_size), b''):
+            h_src.update(chunk)
+            fout.write(chunk)
+    h_dst = hashlib.sha256()
+    with open(dst, 'rb') as FILE:
+        for chunk in iter(lambda: FILE.read(chunk_size), b''):
+            h_dst.update(chunk)
+    if h_src.digest() != h_dst.digest():
+        os.remove(dst)
+        raise IOError('Checksum mismatch copying %s to %s.' % (src, dst))
+
+
+def link_or_copy(src, dst, chunk_size=2 ** 24):
+    """Put a file in the BIDS tree, using as little I/O as possible.
+
+    Parameters
+    ----------
+    src : str
+        The source file.
+    dst : str
+        The destination file.
+    chunk_size : int
+        The chunk size of the copy, if the file cannot be linked.
+
+    Returns
+    -------
+    how : 'unchanged' | 'link' | 'reflink' | 'copy'
+        How the file was exported.
+    """
+    if _same_file(src, dst):
+        return 'unchanged'
+    if op.lexists(dst):
+        os.remove(dst)
+    if not op.isdir(op.dirname(dst)):
+        os.makedirs(op.dirname(dst))
+    if os.stat(src).st_dev == os.stat(op.dirname(dst)).st_dev:
+        try:
+            os.link(src, dst)
+            return 'link'
+        except OSError:
+            pass
+        try:
+            _reflink(src, dst)
+            shutil.copystat(src, dst)
+            return 'reflink'
+        except OSError:
+            pass
+    _copy_verified(src, dst, chunk_size)
+    shutil.copystat(src, dst)
+    return 'copy'
+
+
+def merge_participants(src, dst):
+    """Add the participants of a `participants.tsv` to another one."""
+    participants = read_csv(src, sep='\t', dtype=str)
+    if op.exists(dst):
+        participants = concat((read_csv(dst, sep='\t', dtype=str),
+                               participants), sort=False)
+        participants = participants.drop_duplicates('participant_id',
+                                                    keep='last')
+    participants = participants.sort_values('participant_id')
+    participants.to_csv(dst, sep='\t', index=False, na_rep='n/a')
+
+
+def move_subject(staging_root, output_root, subject):
+    """Move a subject exported to a staging root into the BIDS root."""
+    subname = 'sub-{}'.format(subject)
+    src = op.join(staging_root, subname)
+    dst = op.join(output_root, subname)
+    if op.isdir(dst):
+        # keep what was exported separately, e.g. the eyetracking
+        for kind in os.listdir(src):
+            if op.isdir(op.join(dst, kind)) and \
+                    op.isdir(op.join(src, kind)):
+                for fname in os.listdir(op.join(src, kind)):
+                    os.replace(op.join(src, kind, fname),
+                               op.join(dst, kind, fname))
+            else:
+                os.replace(op.join(src, kind), op.join(dst, kind))
+    else:
+        os.replace(src, dst)
+    fname_participants = op.join(staging_root, 'participants.tsv')
+    if op.exists(fname_participants):
+        merge_participants(fname_participants,
+                           op.join(output_root, 'participants.tsv'))
+    shutil.rmtree(staging_root)
@@ -0,0 +1,116 @@
+"""
+Raw Data Manifest
+-----------------
+Listing directories on the network-mounted archive is slow, and the configs
+glob it every time they are imported. The manifest keeps the listing of
+every directory looked up, persisted in the user cache, and checks it
+against the directory mtime, which only changes when entries are added or
+removed. A lookup then costs one `stat` instead of a listing.
+"""
+import os
+import os.path as op
+import json
+import hashlib
+from fnmatch import fnmatch
+
+
+cache_dir = op.join(op.expanduser('~'), '.cache', 'OcularLDT')
+_manifests = dict()
+
+
+class Manifest(object):
+    """Cached listings of the directories under a root.
+
+    Parameters
+    ----------
+    root : str
+        The root of the raw data tree.
+    fname : None | str
+        Where to persist the manifest. If None, it is kept in the user
+        cache, named after the root.
+    """
+    def __init__(self, root, fname=None):
+        self.root = op.abspath(root)
+        if fname is None:
+            key = hashlib.sha1(self.root.encode('utf-8')).hexdigest()[:12]
+            fname = op.join(cache_dir, 'manifest-%s.json' % key)
+        self.fname = fname
+        self._dirs = dict()
+        if op.exists(fname):
+            try:
+                with open(fname) as FILE:
+                    self._dirs = json.load(FILE)['dirs']
+            except (ValueError, KeyError):
+                pass
+
+    def listdir(self, dirname):
+        """List a directory, from the manifest if it has not changed."""
+        key = op.relpath(op.abspath(dirname), self.root)
+        try:
+            mtime = os.stat(dirname).st_mtime_ns
+        except OSError:
+            return list()
+        entry = self._dirs.get(key)
+        if entry is None or entry['mtime'] != mtime:
+            entry = {'mtime': mtime, 'files': sorted(os.listdir(dirname))}
+            self._dirs[key] = entry
+            self.save()
+        return entry['files']
+
+    def glob(self, pattern):
+        """Like `glob.glob`, for patterns with wildcards in the basename."""
+        dirname, basename = op.split(pattern)
+        return [op.join(dirname, name) for name in self.listdir(dirname)
+                if fnmatch(name, basename)]
+
+    def save(self):
+        dirname = op.dirname(self.fname)
+        if not op.isdir(dirname):
+            os.makedirs(dirname)
+        # write then rename, so that concurrent readers never see half a file
+        fname_tmp = '%s.%d.tmp' % (self.fname, os.getpid())
+        with open(fname_tmp, 'w') as FILE:
+            json.dump({'root': self.root, 'dirs': self._dirs}, FILE)
+        os.replace(fname_tmp, self.fname)
+
+
+def get_manifest(root):
+    """Get the manifest of a root, loaded once per process."""
+    root = op.abspath(root)
+    if root not in _manifests:
+        _manifests[root] = Manifest(root)
+    return _manifests[root]
+
+
+def find_kit_file(path, subject, exp, role):
+    """Find a KIT file of a subject in the raw data tree.
+
+    Parameters
+    ----------
+    path : str
+        The root of the raw data tree.
+    subject : str
+        The subject, e.g. 'A0023'.
+    exp : str
+        The experiment, e.g. 'OLDT1'. Not used for the `elp` and `hsp`.
+    role : 'con' | 'mrk_pre' | 'mrk_post' | 'elp' | 'hsp'
+        The file to find.
+
+    Returns
+    -------
+    fname : str
+        The first matching file.
+    """
+    patterns = {'con': subject + '*' + exp + '*' + 'calm.con',
+                'mrk_pre': subject + '*mrk*' + 'pre_' + exp + '*.mrk',
+                'mrk_post': subject + '*mrk*' + 'post_' + exp + '*.mrk',
+                'elp': subject + '*p.txt',
+                'hsp': subject + '*h.txt'}
+    if role not in patterns:
+        raise ValueError('role must be one of %s, not %s.'
+                         % (sorted(patterns), role))
+    pattern = op.join(path, subject, 'kit', patterns[role])
+    fnames = get_manifest(path).glob(pattern)
+    if not fnames:
+        raise IOError('No %s file matching %s.' % (role, pattern))
+    return fnames[0]
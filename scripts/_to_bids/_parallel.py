@@ -0,0 +1,112 @@
+"""
+Parallel Batches
+----------------
+Helpers to run a per-subject function over the cohort in a process pool.
+Each worker can be given a memory ceiling so that several subjects can be
+processed on one node without swapping, and a cap on the threads of its
+BLAS, so that the workers do not oversubscribe the cores. A subject that
+fails does not stop the batch; the failures are reported at the end.
+"""
+import os
+import resource
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def limit_memory(mem_limit):
+    """Cap the address space of the current process, in bytes."""
+    if mem_limit is None:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        mem_limit = min(mem_limit, hard)
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (int(mem_limit), hard))
+    except (ValueError, OSError):
+        # e.g. macOS does not support limiting the address space
+        print('Could not set the memory ceiling of the worker.')
+
+
+# the variables read by the BLAS and OpenMP libraries when they are loaded
+_thread_vars = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+
+def limit_threads(n_threads):
+    """Cap the threads of the BLAS libraries of the current process."""
+    if n_threads is None:
+        return
+    for var in _thread_vars:
+        os.environ[var] = str(n_threads)
+    # the libraries already loaded do not read the variables again
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(n_threads)
+
+
+def _init_worker(mem_limit, n_threads):
+    limit_memory(mem_limit)
+    limit_threads(n_threads)
+
+
+def run_parallel(func, args, n_jobs=1, mem_limit=None, n_threads=None):
+    """Call `func(*arg)` for every `arg` in `args`.
+
+    Parameters
+    ----------
+    func : callable
+        A module-level function, so that it can be pickled.
+    args : list of tuple
+        The arguments of each call. The first one is used to name the call
+        in the report, e.g. the subject.
+    n_jobs : int
+        The number of worker processes. If 1, the calls are made serially
+        in the current process.
+    mem_limit : None | float
+        The memory ceiling of each worker, in bytes.
+    n_threads : None | int
+        The number of BLAS threads of each worker. If None, the libraries
+        decide, usually one per core.
+
+    Returns
+    -------
+    results : dict
+        The results of the calls that succeeded, keyed by their first
+        argument.
+    """
+    results = dict()
+    failed = dict()
+    if n_jobs == 1:
+        for arg in args:
+            try:
+                results[arg[0]] = func(*arg)
+            except Exception:
+                failed[arg[0]] = traceback.format_exc()
+    else:
+        # the workers started from scratch inherit the variables; they are
+        # started on demand, so the variables are kept until the end
+        environ = os.environ.copy()
+        if n_threads is not None:
+            os.environ.update({var: str(n_threads) for var in _thread_vars})
+        try:
+            with ProcessPoolExecutor(n_jobs, initializer=_init_worker,
+                                     initargs=(mem_limit, n_threads)) as pool:
+                futures = {pool.submit(func, *arg): arg[0] for arg in args}
+                for future in as_completed(futures):
+                    key = futures[future]
+                    try:
+                        results[key] = future.result()
+                    except MemoryError:
+                        failed[key] = ('Exceeded the memory ceiling of %s '
+                                       'bytes.' % mem_limit)
+                    except Exception:
+                        failed[key] = traceback.format_exc()
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+
+    for key, error in sorted(failed.items()):
+        print('%s failed:\n%s' % (key, error))
+    return results
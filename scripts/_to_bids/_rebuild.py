@@ -0,0 +1,167 @@
+"""
+Incremental Rebuilds
+--------------------
+Each per-subject stage records, for its outputs, the content hash of every
+input file and the parameters it was computed with. A stage is only run
+again when an output is missing, an input changed or a parameter changed,
+so changing e.g. `reject` only reruns the stages that use it, and a new
+subject does not rerun the cohort.
+
+The records are kept in the user cache, not next to the outputs, so that
+the BIDS tree stays valid. Hashing a large file is only done when its size
+or mtime differ from the record.
+"""
+import os
+import os.path as op
+import json
+import hashlib
+import numpy as np
+
+
+cache_dir = op.join(op.expanduser('~'), '.cache', 'OcularLDT', 'rebuild')
+# hashes computed in this process, keyed by file name, size and mtime
+_hashes = dict()
+
+
+def file_hash(fname, chunk_size=2 ** 24):
+    """Compute the BLAKE2 hash of a file, reading it in chunks."""
+    h = hashlib.blake2b(digest_size=20)
+    with open(fname, 'rb') as FILE:
+        for chunk in iter(lambda: FILE.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def info_digest(info, sensors_only=False):
+    """Hash the parts of a measurement info that models depend on.
+
+    Parameters
+    ----------
+    info : instance of Info
+        The measurement info.
+    sensors_only : bool
+        If True, only the channel names and locations and the device to
+        head transform are hashed, e.g. for a forward model. Otherwise,
+        the bad channels and the projectors are hashed as well.
+
+    Returns
+    -------
+    digest : str
+        The hash.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    h.update(json.dumps(info['ch_names']).encode('utf-8'))
+    h.update(np.array([ch['loc'] for ch in info['chs']]).tobytes())
+    if info['dev_head_t'] is not None:
+        h.update(np.asarray(info['dev_head_t']['trans']).tobytes())
+    if not sensors_only:
+        h.update(json.dumps(sorted(info['bads'])).encode('utf-8'))
+        for proj in info['projs']:
+            h.update(json.dumps(proj['data']['col_names']).encode('utf-8'))
+            h.update(np.asarray(proj['data']['data']).tobytes())
+    return h.hexdigest()
+
+
+def _normalize_params(params):
+    # round-trip through JSON, so that tuples and lists compare equal
+    return json.loads(json.dumps(params or dict(), sort_keys=True,
+                                 default=repr))
+
+
+def _get_record_fname(output):
+    key = hashlib.sha1(op.abspath(output).encode('utf-8')).hexdigest()
+    return op.join(cache_dir, key + '.json')
+
+
+def _as_list(fnames):
+    if isinstance(fnames, str):
+        fnames = [fnames]
+    return [op.abspath(fname) for fname in fnames]
+
+
+def _stat(fname):
+    stat = os.stat(fname)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+
+def _cached_hash(fname, stat):
+    key = (fname, stat['size'], stat['mtime'])
+    if key not in _hashes:
+        _hashes[key] = file_hash(fname)
+    return _hashes[key]
+
+
+def _read_record(outputs):
+    record_fname = _get_record_fname(outputs[0])
+    if not op.exists(record_fname):
+        return None
+    with open(record_fname) as FILE:
+        return json.load(FILE)
+
+
+def is_stale(outputs, inputs=(), params=None, force=False):
+    """Check whether the outputs of a stage need to be computed again.
+
+    Parameters
+    ----------
+    outputs : str | list of str
+        The output files of the stage.
+    inputs : list of str
+        The input files of the stage.
+    params : dict
+        The parameters of the stage. They must be JSON serializable, or
+        have a stable `repr`.
+    force : bool
+        If True, the outputs are stale no matter what.
+
+    Returns
+    -------
+    stale : bool
+        Whether to run the stage.
+    """
+    outputs = _as_list(outputs)
+    if force or not all(op.exists(output) for output in outputs):
+        return True
+    record = _read_record(outputs)
+    if record is None or record['outputs'] != outputs:
+        return True
+    if record['params'] != _normalize_params(params):
+        return True
+    inputs = _as_list(inputs)
+    if sorted(record['inputs']) != sorted(inputs):
+        return True
+    for fname in inputs:
+        if not op.exists(fname):
+            return True
+        recorded = record['inputs'][fname]
+        stat = _stat(fname)
+        if (stat['size'], stat['mtime']) == (recorded['size'],
+                                             recorded['mtime']):
+            continue
+        if _cached_hash(fname, stat) != recorded['hash']:
+            return True
+    return False
+
+
+def record(outputs, inputs=(), params=None):
+    """Record the inputs and parameters the outputs were computed from."""
+    outputs = _as_list(outputs)
+    previous = (_read_record(outputs) or dict()).get('inputs', dict())
+    entries = dict()
+    for fname in _as_list(inputs):
+        entries[fname] = stat = _stat(fname)
+        # the files that did not change are not hashed again
+        recorded = previous.get(fname, dict())
+        if (recorded.get('size'), recorded.get('mtime')) == \
+                (stat['size'], stat['mtime']):
+            stat['hash'] = recorded['hash']
+        else:
+            stat['hash'] = _cached_hash(fname, stat)
+    if not op.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    record_fname = _get_record_fname(outputs[0])
+    fname_tmp = '%s.%d.tmp' % (record_fname, os.getpid())
+    with open(fname_tmp, 'w') as FILE:
+        json.dump({'outputs': outputs, 'inputs': entries,
+                   'params': _normalize_params(params)}, FILE)
+    os.replace(fname_tmp, record_fname)
@@ -13,82 +13,124 @@ Nonword += 8
 
 This recoding efficiency allows for Hierarchial Event Descriptors
 (HED tags).
+
+Trigger layouts
+---------------
+The stimulus triggers pack the trial info into bit fields. Each layout lists
+the fields as (name, shift, n_bits), and the positions of prime and target.
+
+OLDT: expt (bit 5), semantic (bit 4), nonword_pos (bits 2-3),
+      current_pos (bits 0-1). prime = 1, target = 2.
+SENT: expt (bit 4), semantic (bit 3), current_pos (bits 0-2).
+      prime = 1, target = 3.
 """
 import numpy as np
 
 
+TRIGGER_LAYOUTS = {
+    'OLDT': {'fields': (('expt', 5, 1),
+                        ('semantic', 4, 1),
+                        ('nonword_pos', 2, 2),
+                        ('current_pos', 0, 2)),
+             'prime': 1, 'target': 2},
+    'SENT': {'fields': (('expt', 4, 1),
+                        ('semantic', 3, 1),
+                        ('current_pos', 0, 3)),
+             'prime': 1, 'target': 3},
+}
+
+FIXATION_CODE = 128
+
+
+def _get_layout(exp):
+    for key, layout in TRIGGER_LAYOUTS.items():
+        if exp.startswith(key):
+            return layout
+    raise ValueError('This function only works for '
+                     'OLDTX or SENTX experiments, not %s.' % exp)
+
+
+def decode_triggers(exp, triggers):
+    """Decode the trigger bit fields of an experiment.
+
+    Parameters
+    ----------
+    exp : str
+        Experiment name, e.g. 'OLDT1' or 'SENT2'.
+    triggers : array, shape (n_triggers,)
+        The trigger values.
+
+    Returns
+    -------
+    fields : structured array, shape (n_triggers,)
+        One field per entry in the layout. Single bit fields are bool.
+    """
+    layout = _get_layout(exp)
+    triggers = np.asarray(triggers).astype(int)
+    dtype = [(name, bool if n_bits == 1 else int)
+             for name, _, n_bits in layout['fields']]
+    fields = np.empty(triggers.shape, dtype=dtype)
+    for name, shift, n_bits in layout['fields']:
+        fields[name] = (triggers >> shift) & (2 ** n_bits - 1)
+    return fields
+
+
+def recode_triggers(exp, triggers):
+    """Compute the HED-style codes of the triggers in one pass.
+
+    Parameters
+    ----------
+    exp : str
+        Experiment name, e.g. 'OLDT1' or 'SENT2'.
+    triggers : array, shape (n_triggers,)
+        The trigger values. Practice triggers are not removed.
+
+    Returns
+    -------
+    codes : array, shape (n_triggers,)
+        The recoded triggers.
+    fields : structured array, shape (n_triggers,)
+        The decoded bit fields, see ``decode_triggers``.
+    """
+    layout = _get_layout(exp)
+    fields = decode_triggers(exp, triggers)
+    current_pos = fields['current_pos']
+
+    codes = ((current_pos == layout['prime']) * 1 +
+             (current_pos == layout['target']) * 2 +
+             fields['semantic'] * 4)
+    if 'nonword_pos' in fields.dtype.names:
+        nonword_pos = fields['nonword_pos']
+        codes += ((nonword_pos == current_pos) & (nonword_pos != 0)) * 8
+    codes[current_pos == 0] = FIXATION_CODE
+    return codes, fields
+
+
 def _recode_events(exp, evts, idx=True):
     evts = evts.astype(int)
-    if exp.startswith('OLDT'):
-        # remove practice
-        expt = np.array([(x & 2 ** 5) >> 5 for x in evts[:, 2]], dtype=bool)
-        evts = evts[expt]
-        # force type to int
-        triggers = evts[:, 2]
-
-        semantic = np.array([(x & 2 ** 4) >> 4 for x in triggers],
-                            dtype=bool)
-        nonword_pos = np.array([(x & (2 ** 3 + 2 ** 2)) >> 2
-                                for x in triggers])
-        current_pos = np.array([(x & (2 ** 1 + 2 ** 0)) >> 0
-                                for x in triggers])
-
-        idx = np.where(nonword_pos - current_pos != 0)[0]
-        idy = np.where(current_pos < nonword_pos)[0]
-        idy2 = np.where(nonword_pos == 0)[0]
-        idy3 = np.where(current_pos != 0)[0]
-        idy = np.unique(np.hstack((idy, idy2, idy3)))
-        n_idx = np.where(nonword_pos - current_pos == 0)[0]
-        n_idy = np.where(nonword_pos != 0)[0]
-
-        # nonwords vs words
-        words_idx = np.intersect1d(idx, idy)
-        nonwords_idx = np.intersect1d(n_idx, n_idy)
-        # fixation
-        fix_idx = np.where(current_pos == 0)[0]
-        # prime vs target
-        primes_idx = np.where(current_pos == 1)[0]
-        targets_idx = np.where(current_pos == 2)[0]
-        # semantic
-        semantic_idx = np.where(semantic)[0]
-
-    elif exp.startswith('SENT'):
-        # remove practice
-        expt = np.array([(x & 2 ** 4) >> 4 for x in evts[:, 2]], dtype=bool)
-        evts = evts[expt]
-        idx = np.nonzero(evts[:, 2])[0]
-        evts = evts[idx]
-        triggers = evts[:, 2]
-
-        semantic = np.array([(x & 2 ** 3) >> 3 for x in triggers],
-                            dtype=bool)
-        current_pos = np.array([(x & (2 ** 2 + 2 ** 1 + 2 ** 0)) >> 0
-                                for x in triggers])
-
-        semantic_idx = np.where(semantic)[0]
-        fix_idx = np.where(current_pos == 0)[0]
-        primes_idx = np.where(current_pos == 1)[0]
-        targets_idx = np.where(current_pos == 3)[0]
+    layout = _get_layout(exp)
+    # remove practice
+    evts = evts[decode_triggers(exp, evts[:, 2])['expt']]
+    if exp.startswith('SENT'):
+        evts = evts[np.nonzero(evts[:, 2])[0]]
+    codes, fields = recode_triggers(exp, evts[:, 2])
+    current_pos = fields['current_pos']
 
-    else:
-        raise ValueError('This function only works for '
-                         'OLDTX or SENTX experiments, not %s.' % exp)
+    # fixation
+    fix_idx = np.flatnonzero(current_pos == 0)
+    # prime vs target
+    primes_idx = np.flatnonzero(current_pos == layout['prime'])
+    targets_idx = np.flatnonzero(current_pos == layout['target'])
+    # semantic
+    semantic_idx = np.flatnonzero(fields['semantic'])
 
     ############
     # Recoding #
     ############
-    recodeds = np.zeros((evts.shape[0], 1), int)
-    evts = np.hstack((evts, recodeds))
-    # prime vs target
-    evts[primes_idx, -1] += 1
-    evts[targets_idx, -1] += 2
-    # semantic priming
-    evts[semantic_idx, -1] += 4
-    # fixation
-    evts[fix_idx, -1] = 128
+    evts = np.hstack((evts, codes[:, np.newaxis]))
     if exp.startswith('OLDT'):
         # word vs nonword
-        evts[nonwords_idx, -1] += 8
+        nonwords_idx = np.flatnonzero(codes & 8)
         return evts, fix_idx, primes_idx, targets_idx, semantic_idx, nonwords_idx
     else:
         return evts, fix_idx, primes_idx, targets_idx, semantic_idx
@@ -0,0 +1,83 @@
+"""
+Streaming Stim Steps
+--------------------
+`mne.find_stim_steps` needs the whole trigger channel in memory and, in
+practice, the whole raw file loaded. Here, only the stim channel is read,
+chunk by chunk, from a raw file that is not preloaded. The last sample of
+each chunk is carried over so that steps across chunk boundaries are
+detected. The steps found are few compared with the samples, so the merging
+is done once at the end, with the same semantics as MNE.
+"""
+import numpy as np
+import mne
+from mne.event import _get_stim_channel
+
+
+def _merge_steps(steps, merge):
+    """Merge steps that are closer than `merge` samples (as in MNE)."""
+    if merge == 0 or len(steps) < 2:
+        return steps
+    idx = np.diff(steps[:, 0]) <= abs(merge)
+    if not np.any(idx):
+        return steps
+    where = np.flatnonzero(idx)
+    keep = np.logical_not(idx)
+    if merge > 0:
+        # drop the earlier event
+        steps[where + 1, 1] = steps[where, 1]
+        keep = np.append(keep, True)
+    else:
+        # drop the later event
+        steps[where, 2] = steps[where + 1, 2]
+        keep = np.insert(keep, 0, True)
+    is_step = steps[:, 1] != steps[:, 2]
+    return steps[np.logical_and(keep, is_step)]
+
+
+def find_stim_steps_chunked(raw, merge=0, stim_channel=None,
+                            chunk_duration=60.):
+    """Find all steps in the stim channel, reading it in chunks.
+
+    Parameters
+    ----------
+    raw : str | instance of Raw
+        The raw FIF file name or a raw instance, which should not be
+        preloaded.
+    merge : int
+        Merge steps occurring within `merge` samples, as in
+        `mne.find_stim_steps`. A negative value keeps the earlier step.
+    stim_channel : None | str | list of str
+        The stim channel(s). If None, the MNE default is used.
+    chunk_duration : float
+        The duration of the chunks read from disk, in seconds.
+
+    Returns
+    -------
+    steps : array of int, shape (n_steps, 3)
+        The sample, the value before and the value after each step.
+    """
+    if isinstance(raw, str):
+        raw = mne.io.read_raw_fif(raw, preload=False, verbose=False)
+    stim_channel = _get_stim_channel(stim_channel, raw.info)
+    picks = mne.pick_channels(raw.info['ch_names'], include=stim_channel)
+    if len(picks) == 0:
+        raise ValueError('No stim channel found to extract event triggers.')
+
+    n_chunk = max(int(round(chunk_duration * raw.info['sfreq'])), 1)
+    steps = list()
+    last = None
+    for start in range(0, raw.n_times, n_chunk):
+        stop = min(start + n_chunk, raw.n_times)
+        data = np.abs(raw.get_data(picks, start, stop)).astype(np.int64)
+        offset = raw.first_samp + start
+        # prepend the last sample of the previous chunk
+        if last is not None:
+            data = np.hstack((last, data))
+            offset -= 1
+        last = data[:, -1:]
+
+        idx = np.flatnonzero(np.all(np.diff(data, axis=1) != 0, axis=0))
+        steps.append(np.c_[idx + 1 + offset, data[0, idx], data[0, idx + 1]])
+
+    steps = np.vstack(steps) if steps else np.empty((0, 3), np.int64)
+    return _merge_steps(steps, merge)
@@ -0,0 +1,151 @@
+"""
+Streaming Filter and Concatenate
+--------------------------------
+Interpolates the bad channels, concatenates and band-pass filters runs
+block by block, without loading them.
+
+The filter is the IIR filter of `raw.filter(..., method='iir')`: the same
+second-order sections and padding, applied forward then backward. Each run
+is filtered as its own segment, as MNE does between the boundaries of
+concatenated raws. The forward pass carries the filter state from block to
+block and writes to a memory-mapped file next to the output; the backward
+pass goes over the blocks in reverse and overwrites them in place. The
+padding at both ends of a run is built from its first and last samples.
+"""
+import os
+import numpy as np
+from scipy.signal import sosfilt, sosfilt_zi
+import mne
+
+
+def interpolation_operator(raw):
+    """Get the linear operator of `raw.interpolate_bads()`.
+
+    Returns
+    -------
+    operator : None | array, shape (n_channels, n_channels)
+        None if there are no bad channels.
+    """
+    if not raw.info['bads']:
+        return None
+    n_channels = len(raw.ch_names)
+    # interpolating the identity gives the operator itself
+    eye = mne.io.RawArray(np.eye(n_channels), raw.info.copy(), verbose=False)
+    eye.interpolate_bads(reset_bads=True, verbose=False)
+    return eye.get_data()
+
+
+def _read_block(raw, operator, start, stop):
+    data = raw.get_data(start=start, stop=stop)
+    if operator is not None:
+        data = np.dot(operator, data)
+    return data
+
+
+def _filter_run(raw, operator, data, offset, picks, sos, padlen, n_block):
+    """Filter one run into `data[:, offset:offset + raw.n_times]`."""
+    n_times = raw.n_times
+    padlen = min(padlen, n_times - 1)
+    blocks = [(start, min(start + n_block, n_times))
+              for start in range(0, n_times, n_block)]
+    zi = sosfilt_zi(sos)[:, np.newaxis, :]
+
+    # forward pass, starting on the odd extension of the first samples
+    head = _read_block(raw, operator, 0, padlen + 1)[picks]
+    head = 2 * head[:, :1] - head[:, padlen:0:-1]
+    x_0 = head[:, 0] if padlen else _read_block(raw, operator, 0, 1)[picks, 0]
+    z = zi * x_0[np.newaxis, :, np.newaxis]
+    if padlen:
+        _, z = sosfilt(sos, head, zi=z)
+    for start, stop in blocks:
+        block = _read_block(raw, operator, start, stop)
+        block[picks], z = sosfilt(sos, block[picks], zi=z)
+        data[:, offset + start:offset + stop] = block
+
+    # ... and on the odd extension of the last samples
+    tail = _read_block(raw, operator, n_times - padlen - 1, n_times)[picks]
+    tail = 2 * tail[:, -1:] - tail[:, -2:-(padlen + 2):-1]
+    if padlen:
+        tail, z = sosfilt(sos, tail, zi=z)
+        y_0 = tail[:, -1]
+    else:
+        y_0 = data[picks, offset + n_times - 1]
+
+    # backward pass, in place
+    z = zi * y_0[np.newaxis, :, np.newaxis]
+    if padlen:
+        _, z = sosfilt(sos, tail[:, ::-1], zi=z)
+    for start, stop in blocks[::-1]:
+        block = data[picks, offset + start:offset + stop][:, ::-1]
+        block, z = sosfilt(sos, block, zi=z)
+        data[picks, offset + start:offset + stop] = block[:, ::-1]
+
+
+def filter_concatenate_raws(raws, fname_out, l_freq, h_freq,
+                            block_duration=10., overwrite=False):
+    """Interpolate, concatenate, band-pass filter and save raws in blocks.
+
+    Parameters
+    ----------
+    raws : list of Raw
+        The runs, not preloaded, with their bad channels marked. They must
+        share their channels and sampling frequency.
+    fname_out : str
+        The output raw FIF file name.
+    l_freq, h_freq : float
+        The edges of the band-pass IIR filter.
+    block_duration : float
+        The duration of the blocks read from each run, in seconds.
+    overwrite : bool
+        Whether to overwrite an existing output.
+
+    Returns
+    -------
+    fname_out : str
+        The output raw FIF file name.
+    """
+    info = raws[0].info.copy()
+    sfreq = info['sfreq']
+    picks = mne.pick_types(info, meg=True, eeg=True, ref_meg=False,
+                           exclude=[])
+    iir_params = mne.filter.create_filter(None, sfreq, l_freq, h_freq,
+                                          method='iir', verbose=False)
+    sos, padlen = iir_params['sos'], iir_params['padlen']
+    n_block = max(int(round(block_duration * sfreq)), 1)
+
+    n_times = sum(raw.n_times for raw in raws)
+    fname_tmp = fname_out + '.tmp.dat'
+    data = np.memmap(fname_tmp, dtype=np.float64, mode='w+',
+                     shape=(len(info['ch_names']), n_times))
+    try:
+        offset = 0
+        boundaries = list()
+        for raw in raws:
+            if offset:
+                boundaries.append(offset / sfreq)
+            _filter_run(raw, interpolation_operator(raw), data, offset,
+                        picks, sos, padlen, n_block)
+            offset += raw.n_times
+
+        info['bads'] = list()
+        unlock = getattr(info, '_unlock', None)
+        if unlock is not None:
+            with unlock():
+                info['highpass'], info['lowpass'] = l_freq, h_freq
+        else:
+            info['highpass'], info['lowpass'] = l_freq, h_freq
+        raw = mne.io.RawArray(data, info, first_samp=raws[0].first_samp,
+                              verbose=False)
+        # mark the run boundaries, as `mne.concatenate_raws` does
+        if boundaries:
+            onsets = np.repeat(boundaries, 2)
+            descriptions = ['BAD boundary', 'EDGE boundary'] * len(boundaries)
+            raw.set_annotations(mne.Annotations(onsets, np.zeros(len(onsets)),
+                                                descriptions))
+        raw.save(fname_out, overwrite=overwrite)
+        del raw
+    finally:
+        # the memory-mapped file is removed even if the filter or save fail
+        del data
+        os.remove(fname_tmp)
+    return fname_out
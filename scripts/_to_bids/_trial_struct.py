@@ -0,0 +1,58 @@
+"""
+MEG Trial Structure
+-------------------
+The trial structure lists, for each fixation, prime and target event, the
+trial it belongs to, its sample and its old and recoded triggers. It is
+used to co-register the MEG with the EM data in the 102 scripts.
+
+It is stored as typed columns in an `.npz` file.
+"""
+import numpy as np
+from pandas import DataFrame
+
+
+TRIAL_STRUCT_COLUMNS = ('trial', 'i_start', 'old_trigger', 'trigger')
+
+
+def make_trial_struct(evts):
+    """Number the trials of recoded events.
+
+    Parameters
+    ----------
+    evts : array, shape (n_events, 4)
+        The recoded events: sample, previous trigger, trigger, new trigger.
+
+    Returns
+    -------
+    trial_struct : dict of array
+        The trial structure columns, see ``TRIAL_STRUCT_COLUMNS``.
+    evts : array, shape (n_trial_events, 4)
+        The events kept in the trial structure, sorted by sample.
+    """
+    evts = evts[np.argsort(evts[:, 0], kind='stable')]
+    # at the start of the Experiment, the trigger reset to zero.
+    evts = evts[evts[:, 1] != 255]
+    # a new trial starts when the previous trigger is zero, starting at 0
+    trials = np.cumsum(evts[:, 1] == 0) - 1
+    trial_struct = dict(zip(TRIAL_STRUCT_COLUMNS,
+                            (trials, evts[:, 0], evts[:, 2], evts[:, 3])))
+    return trial_struct, evts
+
+
+def write_trial_struct(fname, trial_struct):
+    """Write the trial structure columns to an `.npz` file."""
+    np.savez(fname, **{key: np.asarray(trial_struct[key], np.int64)
+                       for key in TRIAL_STRUCT_COLUMNS})
+
+
+def read_trial_struct(fname):
+    """Read the trial structure written by ``write_trial_struct``.
+
+    Returns
+    -------
+    trial_struct : DataFrame
+        The trial structure with the columns ``TRIAL_STRUCT_COLUMNS``.
+    """
+    with np.load(fname) as npz:
+        return DataFrame({key: npz[key] for key in TRIAL_STRUCT_COLUMNS},
+                         columns=TRIAL_STRUCT_COLUMNS)
@@ -1,8 +1,8 @@
 import os.path as op
-from glob import glob
 import re
 import itertools
 import numpy as np
+from _manifest import get_manifest
 
 
 # directories
@@ -22,7 +22,9 @@ exp = experiments[index]
 project_name = project_names[index]
 
 # analysis parameters
-redo = True
+# the stages only recompute the outputs whose inputs or parameters changed
+# (see `_rebuild`), set to True to force recomputing everything
+redo = False
 results_dir = op.join(drives['project'], 'output')
 reject = dict(mag=3e-12)
 baseline = (-.2, -.1)
@@ -34,6 +36,11 @@ filts = {'no': 'iir_no',
          'hp0.51': 'iir_hp0.51_lp40', 'hp1': 'iir_hp1_lp40'}
 filt = filts['hp0.51']
 banner = ('#' * 9 + '\n# %s #\n' + '#' * 9)
+# batch processing: mark the bad channels by hand, or run headless in
+# `n_jobs` workers, each capped at `mem_limit` bytes
+interactive = False
+n_jobs = 4
+mem_limit = 16e9
 # determine which drive you're working from
 drive = 'home'
 event_id = {'word/prime/unprimed': 1,
@@ -47,6 +54,6 @@ if exp == 'OLDT':
                      # 'fixation': 128
                     })
 drive = drives[drive]
-subjects = glob(op.join(drive, 'sub-A*'))
+subjects = get_manifest(drive).glob(op.join(drive, 'sub-A*'))
 for ii, subject in enumerate(subjects):
     subjects[ii] = re.findall('/sub-(A[0-9]*)', subject)[0]
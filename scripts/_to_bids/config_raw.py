@@ -1,7 +1,6 @@
-import os.path as op
-from glob import glob
 import itertools
 import numpy as np
+from _manifest import find_kit_file
 
 
 # arrange the OLDT in the presentation order
@@ -30,20 +29,12 @@ subjects = {'A0023': ['OLDT2', 'SENT2', 'OLDT1'],
 
 def kit2fiff(subject, exp, path, dig=True, preload=False):
     from mne.io import read_raw_kit
-    kit = op.join(path, subject, 'kit',
-                  subject + '*' + exp + '*' + 'calm.con')
-    mrk_pre = op.join(path, subject, 'kit',
-                      subject + '*mrk*' + 'pre_' + exp + '*.mrk')
-    mrk_post = op.join(path, subject, 'kit',
-                       subject + '*mrk*' + 'post_' + exp + '*.mrk')
-    elp = op.join(path, subject, 'kit', subject + '*p.txt')
-    hsp = op.join(path, subject, 'kit', subject + '*h.txt')
-
-    mrk_pre = glob(mrk_pre)[0]
-    mrk_post = glob(mrk_post)[0]
-    elp = glob(elp)[0]
-    hsp = glob(hsp)[0]
-    kit = glob(kit)[0]
+    # the files are looked up in the manifest, not globbed
+    kit = find_kit_file(path, subject, exp, 'con')
+    mrk_pre = find_kit_file(path, subject, exp, 'mrk_pre')
+    mrk_post = find_kit_file(path, subject, exp, 'mrk_post')
+    elp = find_kit_file(path, subject, exp, 'elp')
+    hsp = find_kit_file(path, subject, exp, 'hsp')
 
     if dig:
         raw = read_raw_kit(input_fname=kit, mrk=[mrk_pre, mrk_post],
@@ -13,20 +13,30 @@ from matplotlib import gridspec
 
 import mne
 from mne.report import Report
-from mne_bids import read_raw_bids
 from mne_bids.utils import get_entity_vals
 
+from _rebuild import is_stale, record
+from epochs_cache import get_epochs
+from proj_sweep import sweep_projs
+
 
 layout = mne.channels.read_layout('KIT-AD.lout')
 task = 'OcularLDT'
 bids_root = op.join('/', 'Volumes', 'teon-backup', 'Experiments', task)
 derivative = 'pca'
 
-redo = True
+# force recomputing, even if the inputs and parameters did not change
+redo = False
 reject = dict(mag=3e-12)
 baseline = (-.2, -.1)
-tmin, tmax = -.5, 1
+tmin, tmax = -.2, 1
+# the saccade window the SSP is computed on
+proj_tmin, proj_tmax = -.1, .03
 ylim = dict(mag=[-300, 300])
+img_ext = 'png'
+# the number of PCs kept, and the most PCs evaluated in the sweep
+n_mag = 3
+n_mag_max = 10
 
 evts_labels = ['word/prime/unprimed', 'word/prime/primed', 'nonword/prime']
 subjects_list = get_entity_vals(bids_root, entity_key='sub')
@@ -43,28 +53,30 @@ for subject in subjects_list:
     fname_raw = op.join(path, f"sub-{subject}_task-{task}_meg.fif")
     fname_mp_raw = op.join(path, f"sub-{subject}_task-{task}_split-01_meg.fif")
     fname_proj = op.join(path, f"sub-{subject}_task-{task}_proj.fif")
-
-    if not op.exists(fname_proj) or redo:
+    fname_events = op.join(path, f"sub-{subject}_task-{task}_events.tsv")
+    inputs = [fname_raw if op.exists(fname_raw) else fname_mp_raw,
+              fname_events]
+    params = dict(evts_labels=evts_labels, tmin=tmin, tmax=tmax,
+                  baseline=baseline, reject=reject,
+                  crop=(proj_tmin, proj_tmax),
+                  n_mag=n_mag, n_mag_max=n_mag_max)
+
+    if is_stale(fname_proj, inputs, params, force=redo):
         # pca input is from fixation cross to three hashes
         # no language involved
-        # TODO: replace path with basename
-        try:
-            raw = read_raw_bids(fname_raw, bids_root=bids_root)
-        except RuntimeError:
-            raw = read_raw_bids(fname_mp_raw, bids_root=bids_root)
-        events, event_id = mne.events_from_annotations(raw)
-        event_id = {key: value for key, value in event_id.items()
-                    if key in evts_labels}
-        epochs = mne.Epochs(raw, events, event_id, tmin=-.2, tmax=1,
-                            baseline=baseline, reject=reject, verbose=False)
-
-        # compute the SSP
+        epochs = get_epochs(bids_root, subject, task, evts_labels, tmin=tmin,
+                            tmax=tmax, baseline=baseline, reject=reject)
+
+        # compute the SSP. the PCs are ordered, so the first `n_mag` of
+        # `n_mag_max` are the ones computed with `n_mag`
         evoked = epochs.average()
-        ev_proj = evoked.copy().crop(-.1, .03)
-        projs = mne.compute_proj_evoked(ev_proj, n_mag=3)
+        ev_proj = evoked.copy().crop(proj_tmin, proj_tmax)
+        projs_all = mne.compute_proj_evoked(ev_proj, n_mag=n_mag_max)
+        projs = projs_all[:n_mag]
 
-        # apply projector individually
-        evokeds = [evoked.copy().add_proj(proj).apply_proj() for proj in projs]
+        # apply the projectors individually and cumulatively, all at once
+        evokeds, removed_var = sweep_projs(evoked, projs_all,
+                                           tmin=proj_tmin, tmax=proj_tmax)
 
         # 1. plot before and after summary
         fig = plt.figure(figsize=(18, 8))
@@ -74,19 +86,32 @@ for subject in subjects_list:
         evoked.plot(titles={'mag': 'Before: Original Evoked'}, show=False,
                     axes=axes[0], ylim=ylim)
         # remove all
-        evoked_proj = evoked.copy().add_proj(projs).apply_proj()
+        evoked_proj = evokeds['cumulative'][n_mag - 1]
         evoked_proj.plot(titles={'mag': 'After: Evoked - All PCs'}, show=False,
                          axes=axes[1], ylim=ylim)
         rep_group.add_figs_to_section(fig, '%s: Before and After PCA: Evoked'
                                       % subject, 'Before and After All')
 
+        # 1b. plot the variance of the saccade window removed per `n_mag`
+        fig, ax = plt.subplots(figsize=(8, 4))
+        n_mags = np.arange(1, n_mag_max + 1)
+        ax.plot(n_mags, removed_var['cumulative'] * 100, 'o-',
+                label='first n PCs')
+        ax.plot(n_mags, removed_var['single'] * 100, 'o--', label='PC n')
+        ax.axvline(n_mag, color='k', linestyle=':')
+        ax.set(xlabel='n_mag', ylabel='Removed Variance (%)',
+               xticks=n_mags)
+        ax.legend()
+        rep_group.add_figs_to_section(fig, '%s: Removed Variance' % subject,
+                                      'n_mag Sweep', image_format=img_ext)
+
         # 2. plot PCA topos
         p = mne.viz.plot_projs_topomap(projs, layout, show=False)
         rep_group.add_figs_to_section(p, '%s: PCA topos' % subject,
                                       'Topos', image_format=img_ext)
 
         # 3. plot evoked - each proj
-        for ii, ev in enumerate(evokeds):
+        for ii, ev in enumerate(evokeds['single'][:n_mag]):
             exp_var = ev.info['projs'][0]['explained_var'] * 100
             title = 'PC %d: %2.2f%% Explained Variance' % (ii, exp_var)
             tab = 'PC %d' % ii
@@ -103,6 +128,7 @@ for subject in subjects_list:
 
         # save projs
         mne.write_proj(fname_proj, projs)
+        record(fname_proj, inputs, params)
         # cleanup
         del epochs
 rep_group.save(fname_rep_group, open_browser=False)
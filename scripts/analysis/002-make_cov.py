@@ -10,17 +10,27 @@ import os.path as op
 import mne
 from mne.report import Report
 
-from mne_bids import read_raw_bids
-from mne_bids.read import _handle_events_reading
 from mne_bids.utils import get_entity_vals
 
+import config
+from _rebuild import is_stale, record
+from epochs_cache import get_epochs
+from covariance import online_covariance
+
 
 layout = mne.channels.read_layout('KIT-AD.lout')
 task = 'OcularLDT'
 bids_root = op.join('/', 'Volumes', 'teon-backup', 'Experiments', task)
 derivative = 'cov'
 
-redo = True
+# force recomputing, even if the inputs and parameters did not change
+redo = False
+n_jobs = config.n_jobs
+reject = dict(mag=3e-12)
+baseline = (-.2, -.1)
+tmin, tmax = -.2, .2
+# the covariance is computed on the -200:-100 ms baseline
+cov_tmin, cov_tmax = -.2, -.1
 
 evts_labels = ['word/prime/unprimed', 'word/prime/primed', 'nonword/prime']
 subjects_list = get_entity_vals(bids_root, entity_key='sub')
@@ -39,21 +49,17 @@ for subject in subjects_list:
     fname_raw = op.join(path, f"sub-{subject}_task-{task}_meg.fif")
     fname_mp_raw = op.join(path, f"sub-{subject}_task-{task}_split-01_meg.fif")
     fname_cov = op.join(path, f"sub-{subject}_task-{task}_{derivative}.fif")
+    inputs = [fname_raw if op.exists(fname_raw) else fname_mp_raw,
+              events_fname]
+    params = dict(evts_labels=evts_labels, tmin=tmin, tmax=tmax,
+                  baseline=baseline, reject=reject,
+                  crop=(cov_tmin, cov_tmax), method='auto',
+                  estimator='online')
+
+    if is_stale(fname_cov, inputs, params, force=redo):
 
-    if not op.exists(fname_cov) or redo:
-
-        try:
-            raw = mne.io.read_raw_fif(fname_raw)
-        except FileNotFoundError:
-            raw = mne.io.read_raw_fif(fname_mp_raw)
-        # TODO: replace with proper solution
-        raw = _handle_events_reading(events_fname, raw)
-        events, event_id = mne.events_from_annotations(raw)
-        event_id = {key: value for key, value in event_id.items()
-                    if key in evts_labels}
-        epochs = mne.Epochs(raw, events, event_id, tmin=-.2, tmax=.2,
-                            baseline=(-.2, -.1), reject={'mag': 3e-12},
-                            verbose=False)
+        epochs = get_epochs(bids_root, subject, task, evts_labels, tmin=tmin,
+                            tmax=tmax, baseline=baseline, reject=reject)
 
         # # back to coding
         # proj = mne.read_proj(fname_proj)
@@ -69,8 +75,8 @@ for subject in subjects_list:
                                       'Evoked')
 
         # plot covariance and whitened evoked
-        epochs.load_data().crop(-.2, -.1)
-        cov = mne.compute_covariance(epochs, method='auto', verbose=False)
+        epochs.crop(cov_tmin, cov_tmax)
+        cov = online_covariance(epochs, method='auto', n_jobs=n_jobs)
         p = cov.plot(epochs.info, show_svd=0, show=False)[0]
         # comments = ('The covariance matrix is computed on the -200:-100 ms '
         #             'baseline. -100:0 ms is confounded with the eye-mvt.')
@@ -84,6 +90,7 @@ for subject in subjects_list:
 
         # save covariance
         mne.write_cov(fname_cov, cov)
+        record(fname_cov, inputs, params)
 
 rep_group.save(fname_rep_group, overwrite=True, open_browser=False)
 
@@ -1,81 +1,80 @@
 """
 003-make_trans.py
 
-This script is used for the computation of the covariance matrix for
-each subject in the experiment. The covariance matrix is used for the
-inverse estimate when the sensor data is projected to source space.
+This script is used for the coregistration of the head of each subject
+with their MRI. The MRI to head transform is fitted from the KIT
+digitization: first on the fiducials, then with the ICP on the head shape
+points, from which the outliers are dropped before the final fit. The
+transform is used by the forward model (see 004-make_fwd.py).
 """
 import os.path as op
+import numpy as np
 
 import mne
-from mne.report import Report
-
-from mne_bids import read_raw_bids
-from mne_bids.utils import get_entity_vals
-
-
-layout = mne.channels.read_layout('KIT-AD.lout')
-task = 'OcularLDT'
-bids_root = op.join('/', 'Volumes', 'Experiments', task)
-derivative = 'trans'
-
-redo = True
-
-evts_labels = ['word/prime/unprimed', 'word/prime/primed', 'nonword/prime']
-subjects_list = get_entity_vals(bids_root, entity_key='sub')
-
-fname_rep_group = op.join('..', 'output', 'group',
-                          f'group_{task}_{derivative}-report.html')
-rep_group = Report()
-
-for subject in subjects_list[:1]:
-    print("#" * 9 + f"\n# {subject} #\n" + "#" * 9)
-    # define filenames
-    path = op.join(bids_root, f"sub-{subject}", 'meg')
-    fname_raw = op.join(path, f"sub-{subject}_task-{task}_meg.fif")
-    fname_mp_raw = op.join(path, f"sub-{subject}_task-{task}_part-01_meg.fif")
-    fname_cov = op.join(path, "derivatives", f"sub-{subject}_task-{task}_{derivative}.fif")
-
-    if not op.exists(fname_cov) or redo:
-        try:
-            raw = read_raw_bids(fname_raw, bids_root=bids_root)
-        except FileNotFoundError:
-            raw = read_raw_bids(fname_mp_raw, bids_root=bids_root)
-
-        events, event_id = mne.events_from_annotations(raw)
-        event_id = {key: value for key, value in event_id.items()
-                    if key in evts_labels}
-        epochs = mne.Epochs(raw, events, event_id, tmin=-.2, tmax=1,
-                            baseline=baseline, reject=reject, verbose=False)
-
-        # # back to coding
-        # proj = mne.read_proj(fname_proj)
-        # epochs.add_proj(proj)
-        # epochs.apply_proj()
-
-        # plot evoked
-        evoked = epochs.average()
-        p = evoked.plot(titles={'mag': 'Evoked Response'}, show=False)
-        rep.add_figs_to_section(p,
-                                f"{subject}: Evoked Response to Prime Word",
-                                'Evoked')
-
-        # plot covariance and whitened evoked
-        epochs.crop(-.2, -.1, copy=False)
-        cov = mne.compute_covariance(epochs, method='auto', verbose=False)
-        p = cov.plot(epochs.info, show_svd=0, show=False)[0]
-        comments = ('The covariance matrix is computed on the -200:-100 ms '
-                    'baseline. -100:0 ms is confounded with the eye-mvt.')
-        rep.add_figs_to_section(p, f"{subject}: Covariance Matrix",
-                                'Covariance', comments=comments)
-        p = evoked.plot_white(cov, show=False)
-        rep.add_figs_to_section(p,
-                                f"{subject}: Whitened Evoked to Prime Word",
-                                'Covariance')
-
-        # save covariance
-        mne.write_cov(fname_cov, cov)
-
-rep.save(fname_rep, overwrite=True, open_browser=False)
-
-
+from mne.coreg import Coregistration
+
+import config
+import config_raw
+from _manifest import find_kit_file
+from _parallel import run_parallel
+from _rebuild import is_stale, record
+from forward import mri_path, get_fwd_fnames
+
+
+redo = config.redo
+n_jobs = config.n_jobs
+mem_limit = config.mem_limit
+# ICP parameters
+n_iterations = 20
+# the head shape points further than this from the scalp are dropped, in m
+omit_distance = 5e-3
+nasion_weight = 10.
+
+
+def make_trans(subject, experiments):
+    """Fit and save the MRI to head transform of a subject.
+
+    Returns
+    -------
+    dist : None | float
+        The median distance of the head shape points to the scalp in mm, or
+        None if the transform was up to date.
+    """
+    # the digitization is the same for all the runs
+    run = [run for run in experiments if run != 'n/a'][0]
+    path = config.drive
+    fname_trans = get_fwd_fnames(subject, config.exp)['trans']
+    bem_path = op.join(mri_path, subject, 'bem')
+    fnames_head = [op.join(bem_path, subject + '-head%s.fif' % kind)
+                   for kind in ('-dense', '-medium', '')]
+    inputs = ([find_kit_file(path, subject, run, role)
+               for role in ('elp', 'hsp')] +
+              [fname for fname in fnames_head if op.exists(fname)])
+    params = dict(n_iterations=n_iterations, omit_distance=omit_distance,
+                  nasion_weight=nasion_weight)
+    if not is_stale(fname_trans, inputs, params, force=redo):
+        return None
+
+    raw = config_raw.kit2fiff(subject=subject, exp=run, path=path, dig=True)
+    coreg = Coregistration(raw.info, subject, subjects_dir=mri_path,
+                           fiducials='auto')
+    coreg.fit_fiducials(verbose=False)
+    coreg.fit_icp(n_iterations=6, nasion_weight=2., verbose=False)
+    coreg.omit_head_shape_points(distance=omit_distance)
+    coreg.fit_icp(n_iterations=n_iterations, nasion_weight=nasion_weight,
+                  verbose=False)
+    mne.write_trans(fname_trans, coreg.trans, overwrite=True)
+    record(fname_trans, inputs, params)
+
+    return np.median(coreg.compute_dig_mri_distances()) * 1e3
+
+
+if __name__ == '__main__':
+    dists = run_parallel(make_trans, list(config_raw.subjects.items()),
+                         n_jobs=n_jobs, mem_limit=mem_limit)
+    for subject, dist in sorted(dists.items()):
+        print(config.banner % subject)
+        if dist is None:
+            print('unchanged')
+        else:
+            print('median head shape to scalp distance: %.1f mm' % dist)
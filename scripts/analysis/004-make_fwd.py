@@ -1,32 +1,19 @@
-import os.path as op
-import mne
 import config
+from _parallel import run_parallel
+from forward import make_forwards
 
 
-path = op.join(config.drive, '..', 'MRI')
-exp = 'OLDT'
-filt = config.filt
+experiments = config.experiments
 redo = config.redo
+n_jobs = config.n_jobs
+mem_limit = config.mem_limit
 
-for subject in config.subjects:
-    print config.banner % subject
 
-    # Define filenames
-    fname_epo = op.join(config.drive, subject, 'mne', 
-                        subject + '_%s_xca_calm_%s_filt-epo.fif'
-                        % (exp, filt))
-    fname_trans = op.join(config.drive, subject, 'mne',
-                          subject +'-trans.fif')
-    fname_fwd = op.join(config.drive, subject, 'mne',
-                        subject + '_%s-fwd.fif' % exp)
-    bem_sol = op.join(path, subject, 'bem',
-                      subject + '-inner_skull-bem-sol.fif')
-    src = op.join(path, subject, 'bem', subject + '-ico-4-src.fif')
-
-    if not op.exists(fname_fwd) or redo:
-        info = mne.io.read_info(fname_epo)
-
-        fwd = mne.make_forward_solution(info=info, trans=fname_trans, src=src,
-                                        bem=bem_sol, fname=fname_fwd,
-                                        meg=True, eeg=False,
-                                        mindist=0.0, ignore_ref=True)
\ No newline at end of file
+if __name__ == '__main__':
+    args = [(subject, experiments, redo) for subject in config.subjects]
+    made = run_parallel(make_forwards, args, n_jobs=n_jobs,
+                        mem_limit=mem_limit)
+    for subject, exps in sorted(made.items()):
+        print(config.banner % subject)
+        for exp, this_made in sorted(exps.items()):
+            print('%s: %s' % (exp, 'made' if this_made else 'unchanged'))
@@ -1,6 +1,7 @@
 import os.path as op
 import mne
 import config
+from _rebuild import is_stale, record, info_digest
 
 
 path = op.join(config.drive, '..', 'MRI')
@@ -9,7 +10,7 @@ filt = config.filt
 redo = config.redo
 
 for subject in config.subjects:
-    print config.banner % subject
+    print(config.banner % subject)
 
     # Define filenames
     fname_epo = op.join(config.drive, subject, 'mne', 
@@ -22,11 +23,14 @@ for subject in config.subjects:
     fname_inv = op.join(config.drive, subject, 'mne',
                         subject + '_%s-inv.fif' % exp)
 
-    if not op.exists(fname_inv) or redo:
+    info = mne.io.read_info(fname_epo)
+    inputs = [fname_cov, fname_fwd]
+    params = dict(info=info_digest(info))
+    if is_stale(fname_inv, inputs, params, force=redo):
         # COV
         cov = mne.read_cov(fname_cov)
         # INV OP
         fwd = mne.read_forward_solution(fname_fwd, surf_ori=True)
-        info = mne.io.read_info(fname_epo)
         inv_op = mne.minimum_norm.make_inverse_operator(info, fwd, cov)
         mne.minimum_norm.write_inverse_operator(fname_inv, inv_op)
+        record(fname_inv, inputs, params)
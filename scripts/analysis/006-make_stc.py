@@ -0,0 +1,21 @@
+import config
+from _parallel import run_parallel
+from source_projection import make_stcs
+
+
+exp = config.exp
+redo = config.redo
+n_jobs = config.n_jobs
+mem_limit = config.mem_limit
+# the analyses whose rERF evokeds are projected
+analyses = ['priming_logit_no_pca_sensor_analysis',
+            'word-nonword_logit_sensor_analysis']
+
+
+if __name__ == '__main__':
+    args = [(subject, exp, analyses, True, redo) for subject in config.subjects]
+    made = run_parallel(make_stcs, args, n_jobs=n_jobs, mem_limit=mem_limit)
+    for subject, kinds in sorted(made.items()):
+        print(config.banner % subject)
+        for kind, this_made in sorted(kinds.items()):
+            print('%s: %s' % (kind, 'made' if this_made else 'unchanged'))
@@ -2,15 +2,22 @@ from glob import glob
 import os.path as op
 import numpy as np
 
-import pyeparse as pp
 import config
 import config_raw
-from _recode_events import _recode_events
+from _recode_events import decode_triggers, recode_triggers
+from _rebuild import is_stale, record
+from edf_messages import MessageIndex
+from edf_cache import read_raw_cached
 
 
 path = config.drive
 redo = config.redo
 exp_fname = config.exp
+# the trial variables of the fixation times, i.e. the region durations
+time_vars = {'prime': 'TIME_PRIME', 'target': 'TIME_TARGET'}
+# the onset of a region is the time of the `TTL <trigger>` message that the
+# experiment sends to the EyeLink with its MEG trigger
+ttl_prefix = 'TTL '
 
 
 group_ds = list()
@@ -24,92 +31,82 @@ for subject, experiments in config_raw.subjects.items():
                     f'{subject}_{exp_fname}_region_times.txt')
 
     ds = [list(), list(), list(), list(),
-          list(), list(), list(), list(), list()]
+          list(), list(), list(), list(), list(), list()]
     if exp_fname == 'OLDT':
         exps = [experiments[0], experiments[2]]
     else:
         exps = [experiments[1]]
     if 'n/a' in exps:
         exps.pop(exps.index('n/a'))
-    for ii, exp in enumerate(exps):
-        # Define filenames
+
+    # Define filenames
+    fnames_trial = list()
+    files_raw = list()
+    for exp in exps:
         ident = exp
         if exp.startswith('SENT'):
             ident = 'Sime_Sent'
-        fname_trial = glob(op.join(path, subject, 'edf',
-                           '*_%s_*BLOCKTRIAL.dat' % ident))[0]
-        file_raw = op.join(path, subject, 'edf', '%s_%s.edf' % (subject, exp))
+        fnames_trial.append(glob(op.join(path, subject, 'edf',
+                                 '*_%s_*BLOCKTRIAL.dat' % ident))[0])
+        files_raw.append(op.join(path, subject, 'edf',
+                                 '%s_%s.edf' % (subject, exp)))
+    inputs = fnames_trial + files_raw
+    params = dict(exps=exps, onset=ttl_prefix)
+    if not is_stale(fname, inputs, params, force=redo):
+        group_ds.append(np.loadtxt(fname, dtype=str, delimiter=','))
+        continue
+
+    for ii, (exp, fname_trial, file_raw) in enumerate(zip(exps, fnames_trial,
+                                                          files_raw)):
         # extracting triggering info from datasource file.
         # prime trigger is index 8, target trigger is index 10
         dat = np.loadtxt(fname_trial, dtype=str, delimiter='\t')
         if exp.startswith('OLDT'):
             prime_triggers = dat[:, 8].astype(int)
             target_triggers = dat[:,10].astype(int)
-            prime_exp = np.array([(x & 2 ** 5) >> 5 for x in prime_triggers],
-                                 dtype=bool)
-            target_exp = np.array([(x & 2 ** 5) >> 5 for x in target_triggers],
-                                  dtype=bool)
         if exp.startswith('SENT'):
             prime_triggers = dat[:, 4].astype(int)
             target_triggers = dat[:,8].astype(int)
-            prime_exp = np.array([(x & 2 ** 4) >> 4 for x in prime_triggers],
-                                 dtype=bool)
-            target_exp = np.array([(x & 2 ** 4) >> 4 for x in target_triggers],
-                                  dtype=bool)
+        prime_exp = decode_triggers(exp, prime_triggers)['expt']
+        target_exp = decode_triggers(exp, target_triggers)['expt']
 
         prime_triggers = prime_triggers[prime_exp]
         target_triggers = target_triggers[target_exp]
 
-        # extracting fixation times from the edf file.
-        raw = pp.read_raw(file_raw)
+        # extracting fixation times from the edf file, with one pass over
+        # its messages
+        index = MessageIndex(read_raw_cached(file_raw))
         times = list()
+        onsets = list()
         triggers = list()
         trialids = list()
         ias = list()
-        # first for the primes
-        pat = '!V TRIAL_VAR TIME_PRIME'
-        msgs = raw.find_events(pat, 1)[:,-1]
-        prime_times = np.array([int(x[(len(pat) + 1):])
-                                for x in msgs], int)
-        prime_times = prime_times[prime_exp]
-        assert prime_triggers.shape[0] == prime_times.shape[0]
-        times.append(prime_times)
-        triggers.append(prime_triggers)
-        trialids.append(np.arange(len(prime_triggers)) + ii * 240)
-        ias.append(['prime'] * len(prime_triggers))
-        # then for the targets
-        pat = '!V TRIAL_VAR TIME_TARGET'
-        msgs = raw.find_events(pat, 1)[:,-1]
-        target_times = np.array([int(x[(len(pat) + 1):])
-                                 for x in msgs], int)
-        target_times = target_times[target_exp]
-        assert target_triggers.shape[0] == target_times.shape[0]
-        times.append(target_times)
-        triggers.append(target_triggers)
-        trialids.append(np.arange(len(target_triggers)) + ii * 240)
-        ias.append(['target'] * len(target_triggers))
+        for ia, ia_triggers, ia_exp in (('prime', prime_triggers, prime_exp),
+                                        ('target', target_triggers,
+                                         target_exp)):
+            ia_times = index.get(time_vars[ia], int)[ia_exp]
+            assert ia_triggers.shape[0] == ia_times.shape[0]
+            times.append(ia_times)
+            # in ms, as the durations
+            ia_trials = index.get_trials(time_vars[ia])[ia_exp]
+            ttls = np.char.add(ttl_prefix, ia_triggers.astype(str))
+            onsets.append(index.find_times(ttls, ia_trials) * 1e3)
+            triggers.append(ia_triggers)
+            trialids.append(np.arange(len(ia_triggers)) + ii * 240)
+            ias.append([ia] * len(ia_triggers))
 
         # let's do some re-arranging
         times = np.hstack(times)
+        onsets = np.hstack(onsets)
         triggers = triggers_old = np.hstack(triggers)
         trialids = np.hstack(trialids)
         ias = np.hstack(ias)
         # coding trigger events
-        evts = np.zeros((triggers.shape[0], 3))
-        evts[:, 2] = triggers
-        if exp == 'OLDT':
-            evts, fix_idx, primes_idx, targets_idx, \
-                semantic_idx, nonwords_idx = _recode_events(exp, evts)
-        else:
-            evts, fix_idx, primes_idx, targets_idx, \
-                semantic_idx = _recode_events(exp, evts)
-        triggers = evts[:, -1]
-
-        semantics = np.zeros(len(triggers), int)
-        semantics[semantic_idx] = 1
-        words = np.ones(len(triggers), int)
-        if exp == 'OLDT':
-            words[nonwords_idx] = 0
+        triggers, fields = recode_triggers(exp, triggers)
+
+        semantics = fields['semantic'].astype(int)
+        # nonwords are tagged with the +8 bit, SENT has none
+        words = np.where(triggers & 8, 0, 1)
 
         # dummy label
         labels = [subject] * triggers.shape[0]
@@ -124,14 +121,16 @@ for subject, experiments in config_raw.subjects.items():
         ds[6].append(semantics)
         ds[7].append(times)
         ds[8].append(ias)
+        ds[9].append(onsets)
 
     header = ['subject', 'block', 'trial', 'trigger', 'trigger_old',
-              'word', 'priming', 'dur', 'ia']
+              'word', 'priming', 'dur', 'ia', 'onset']
     ds = [np.hstack(d) for d in ds]
     ds = np.vstack(ds).T
     ds = np.vstack((header, ds))
 
     np.savetxt(fname, ds, fmt='%s', delimiter=',')
+    record(fname, inputs, params)
     group_ds.append(ds)
 
 group_ds = np.vstack(group_ds)
@@ -4,8 +4,9 @@ import numpy as np
 from pandas import concat, DataFrame, read_csv
 import config
 import config_raw
-from pyeparse import reading
+from customreading import CustomReading
 from _recode_events import _recode_events
+from _rebuild import is_stale, record
 
 
 path = config.drive
@@ -23,19 +24,21 @@ if config.exp == 'OLDT':
     ia_words = ['fixation', 'prime', 'target', 'post']
 else:
     ia_words = ['fixation', 'aux', 'prime', 'target', 'post']
-# lexical properties
+# the (trigger, string) columns of the BLOCKTRIAL file of each interest area
+ia_columns = {'OLDT': {'prime': (8, 7), 'target': (10, 9), 'post': (12, 11)},
+              'SENT': {'prime': (4, 3), 'aux': (6, 5), 'target': (8, 7),
+                       'post': (10, 9)}}[config.exp]
+# lexical properties, indexed by word
 # header: "Occurences","Word","Length","Freq_HAL","Log_Freq_HAL","BG_Mean"
-lex_props = read_csv(fname_stim, dtype=str, delimiter=',')
-
-# type-cast
-lex_props['BG_Mean'] = map(float, lex_props['BG_Mean'])
-lex_props['Log_Freq_HAL'] = map(float, lex_props['Log_Freq_HAL'])
-# make a useable dict
-lex_bg = dict(zip(lex_props['Word'], lex_props['BG_Mean']))
-lex_freq = dict(zip(lex_props['Word'], lex_props['Log_Freq_HAL']))
+lex_props = read_csv(fname_stim, delimiter=',', index_col='Word',
+                     usecols=['Word', 'Log_Freq_HAL', 'BG_Mean'],
+                     dtype={'Word': str, 'Log_Freq_HAL': float,
+                            'BG_Mean': float})
+# as a dict would, keep the last entry of a word
+lex_props = lex_props[~lex_props.index.duplicated(keep='last')]
 
 for subject, experiments in config_raw.subjects.items():
-    print config.banner % subject
+    print(config.banner % subject)
     # Define output
     fname_ds = op.join(path, subject, 'edf',
                        subject + '_%s_fixation_times.txt' % exp_fname)
@@ -45,18 +48,27 @@ for subject, experiments in config_raw.subjects.items():
         exps = [experiments[1]]
     if 'n/a' in exps:
         exps.pop(exps.index('n/a'))
-    print experiments
+    print(experiments)
+
+    # Define filenames
+    exp_dat = exp_fname
+    if exp_fname == 'SENT':
+        exp_dat = 'Sime_Sent'
+    fnames_trial = [glob(op.join(path, subject, 'edf',
+                         '*_{}_*BLOCKTRIAL.dat'.format(exp_dat)))[0]
+                    for exp in exps]
+    fnames_raw = [op.join(path, subject, 'edf', '{}_{}.edf'.format(subject, exp))
+                  for exp in exps]
+    inputs = fnames_trial + fnames_raw + [fname_ia, fname_stim]
+    params = dict(exps=exps, ia_words=ia_words)
+    if not is_stale(fname_ds, inputs, params, force=redo):
+        group_ds.append(read_csv(fname_ds, index_col=0))
+        continue
+
     subject_ds = list()
     n_trials = 0
-    for ii, exp in enumerate(exps):
-        exp_dat = exp_fname
-        if exp_fname == 'SENT':
-            exp_dat = 'Sime_Sent'
-        # Define filenames
-        fname_trial = glob(op.join(path, subject, 'edf',
-                           '*_{}_*BLOCKTRIAL.dat'.format(exp_dat)))[0]
-        fname_raw = op.join(path, subject, 'edf',
-                            '{}_{}.edf'.format(subject, exp))
+    for ii, (exp, fname_trial, fname_raw) in enumerate(zip(exps, fnames_trial,
+                                                           fnames_raw)):
 
         # extracting lexical properties
         data = np.loadtxt(fname_trial, dtype=str, delimiter='\t')
@@ -67,14 +79,12 @@ for subject, experiments in config_raw.subjects.items():
         data = data[idx]
 
         # extracting fixation times from the edf file.
-        ias = reading.Reading(fname_raw, fname_ia, ia_words)
+        ias = CustomReading(fname_raw, fname_ia, ia_words)
         assert data_orig_len == ias.shape[0]
 
         # trial properties
-        trials = np.arange(data.shape[0])
-        semantics = np.asarray(data[:, 3] == '1', int)
-        sem_dict = dict(zip(trials, semantics))
-        word_dict = dict(zip(trials, data[:, 4].astype(int)))
+        semantics_trial = np.asarray(data[:, 3] == '1', int)
+        words_trial = data[:, 4].astype(int)
 
         if config.exp == 'OLDT':
             iters = [('prime', 1), ('target', 2), ('post', 3)]
@@ -86,45 +96,20 @@ for subject, experiments in config_raw.subjects.items():
             times['trial'] -= n_practice
             # finally drop practice from em data
             times = times[times['trial'] >= 0]
+            trial_idx = times['trial'].values.astype(int)
 
             # coding semantic priming
-            semantics = [sem_dict[x] for x in times['trial']]
+            semantics = semantics_trial[trial_idx]
             # defining word vs. nonword
-            words = [int(word_dict[x] != ii) for x in times['trial']]
-            # extracting triggering info from datasource file.
-            # prime trigger is index 8, target trigger is index 10
-            triggers = list()
-            strings = list()
-            for _, time in times.iterrows():
-                trial = time['trial'].astype(int)
-                if ia == 'prime':
-                    if config.exp == 'OLDT':
-                        triggers.append(data[trial, 8])
-                        strings.append(data[trial, 7].strip('"'))
-                    if config.exp == 'SENT':
-                        triggers.append(data[trial, 4])
-                        strings.append(data[trial, 3].strip('"'))
-                elif ia == 'aux':
-                    triggers.append(data[trial, 6])
-                    strings.append(data[trial, 5].strip('"'))
-                elif ia == 'target':
-                    if config.exp == 'OLDT':
-                        triggers.append(data[trial, 10])
-                        strings.append(data[trial, 9].strip('"'))
-                    if config.exp == 'SENT':
-                        triggers.append(data[trial, 8])
-                        strings.append(data[trial, 7].strip('"'))
-                elif ia == 'post':
-                    if config.exp == 'OLDT':
-                        triggers.append(data[trial, 12])
-                        strings.append(data[trial, 11].strip('"'))
-                    if config.exp == 'SENT':
-                        triggers.append(data[trial, 10])
-                        strings.append(data[trial, 9].strip('"'))
-            bg_means = [lex_bg[string] if string in lex_bg else np.nan
-                        for string in strings]
-            log_freq = [lex_freq[string] if string in lex_freq else np.nan
-                        for string in strings]
+            words = np.asarray(words_trial[trial_idx] != ii, int)
+            # extracting triggering info from datasource file, all the
+            # trials at once
+            trigger_col, string_col = ia_columns[ia]
+            triggers = data[trial_idx, trigger_col]
+            strings = np.char.strip(data[trial_idx, string_col], '"')
+            lex = lex_props.reindex(strings)
+            bg_means = lex['BG_Mean'].values
+            log_freq = lex['Log_Freq_HAL'].values
 
             # coding trigger events
             evts = np.zeros((len(triggers), 3))
@@ -141,7 +126,7 @@ for subject, experiments in config_raw.subjects.items():
             subject_label = [subject] * len(times)
             block = np.ones(len(times), int) * ii
 
-            strings = [string.lower() for string in strings]
+            strings = np.char.lower(strings)
             columns = list(times.columns)
             columns.extend(['priming', 'word', 'string', 'bg_mean', 'log_freq',
                             'ia', 'trigger', 'trigger_old', 'block', 'subject'])
@@ -158,6 +143,7 @@ for subject, experiments in config_raw.subjects.items():
 
     subject_ds = concat(subject_ds)
     subject_ds.to_csv(fname_ds)
+    record(fname_ds, inputs, params)
     group_ds.append(subject_ds)
 
 group_ds = concat(group_ds)
@@ -0,0 +1,67 @@
+"""
+103-make_alignment.py
+
+This script is used for the alignment of the eye tracking and MEG clocks
+of each subject. The map of the EyeLink times to the MEG samples is fitted
+per block on the region onsets that have a MEG trigger (see `alignment`),
+and all the region onsets are then converted to MEG events, including
+those whose trigger is missing. The onset of a region is the EyeLink time
+of the message sent with its trigger (see 101a), not its duration.
+"""
+import os.path as op
+
+import mne
+from pandas import read_table
+
+import config
+from _trial_struct import read_trial_struct
+from _rebuild import is_stale, record
+from coreg_events import coreg_events
+from alignment import fit_alignment
+
+
+path = config.drive
+exp = config.exp
+filt = config.filt
+redo = config.redo
+# the onsets further than `threshold` robust standard deviations from the
+# fit are left out of it
+threshold = 3.
+
+for subject in config.subjects:
+    print(config.banner % subject)
+
+    fname_template = op.join(path, subject, '%s', '_'.join((subject, exp)))
+    fname_meg = fname_template % 'mne' + '_meg_trial_struct.npz'
+    fname_em = fname_template % 'edf' + '_region_times.txt'
+    fname_raw = fname_template % 'mne' + '_calm_%s_filt-raw.fif' % filt
+    fname_align = fname_template % 'mne' + '_alignment.npz'
+    fname_eve = fname_template % 'mne' + '_region_aligned-eve.txt'
+
+    # the sampling frequency is read from the raw
+    inputs = [fname_meg, fname_em, fname_raw]
+    params = dict(threshold=threshold)
+    if not is_stale([fname_align, fname_eve], inputs, params, force=redo):
+        continue
+
+    meg_ds = read_trial_struct(fname_meg)
+    em_ds = read_table(fname_em, sep=',')
+    # the regions without a TTL message have no onset
+    em_ds = em_ds[em_ds['onset'].notnull()]
+    # the shared events: the region onsets with a MEG trigger
+    anchors, evts, _ = coreg_events(meg_ds, em_ds, ['onset', 'block'])
+    sfreq = mne.io.read_info(fname_raw, verbose=False)['sfreq']
+    alignment = fit_alignment(anchors[:, 1], evts[:, 0], anchors[:, 2], sfreq,
+                              threshold=threshold)
+    alignment.save(fname_align)
+    print(alignment)
+    for block, n_outliers, residual in zip(alignment.blocks,
+                                           alignment.n_outliers,
+                                           alignment.residuals):
+        print('block %d: %d outliers, residuals %.2f samples'
+              % (block, n_outliers, residual))
+
+    evts = alignment.to_events(em_ds['onset'], em_ds['block'],
+                               em_ds['trigger'])
+    mne.write_events(fname_eve, evts)
+    record([fname_align, fname_eve], inputs, params)
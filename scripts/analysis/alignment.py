@@ -0,0 +1,161 @@
+"""
+Clock Alignment
+---------------
+The eye tracker and the MEG have their own clocks, and the clocks drift
+apart over a block. Rather than anchoring each eye tracking event on the
+MEG trigger of its trial, a linear map from the EyeLink time (in ms) to the
+MEG sample is fitted per block, on all the events the two share: one piece
+per block, since the EyeLink recording is restarted between the blocks.
+
+The fit is robust: it starts from the median of the slopes between
+consecutive events, then the least squares fit is iterated, each time
+without the events further than `threshold` robust standard deviations
+from the line, e.g. a trigger paired with the wrong trial. Any eye tracking
+event can then be converted to the MEG samples at once.
+"""
+import numpy as np
+
+
+class ClockAlignment(object):
+    """The linear maps of the EyeLink times to the MEG samples.
+
+    Parameters
+    ----------
+    blocks : array of int, shape (n_blocks,)
+        The blocks, sorted.
+    slopes : array, shape (n_blocks,)
+        The samples per ms of each block.
+    intercepts : array, shape (n_blocks,)
+        The sample of the EyeLink time 0 of each block.
+    sfreq : float
+        The sampling frequency of the MEG.
+    n_inliers : array of int, shape (n_blocks,)
+        The number of events each map was fitted on.
+    n_outliers : array of int, shape (n_blocks,)
+        The number of events left out of each fit.
+    residuals : array, shape (n_blocks,)
+        The standard deviation of the residuals of the inliers, in samples.
+    """
+    def __init__(self, blocks, slopes, intercepts, sfreq, n_inliers,
+                 n_outliers, residuals):
+        self.blocks = np.asarray(blocks, int)
+        self.slopes = np.asarray(slopes, float)
+        self.intercepts = np.asarray(intercepts, float)
+        self.sfreq = float(sfreq)
+        self.n_inliers = np.asarray(n_inliers, int)
+        self.n_outliers = np.asarray(n_outliers, int)
+        self.residuals = np.asarray(residuals, float)
+
+    def __repr__(self):
+        return '<ClockAlignment | %d blocks, drift %s ppm>' % (
+            len(self.blocks), ', '.join('%.1f' % d for d in self.drift))
+
+    @property
+    def drift(self):
+        """The drift of the EyeLink clock on the MEG clock, in ppm."""
+        return (self.slopes / (self.sfreq / 1e3) - 1) * 1e6
+
+    def transform(self, times, blocks):
+        """Convert EyeLink times to MEG samples.
+
+        Parameters
+        ----------
+        times : array, shape (n_events,)
+            The EyeLink times, in ms.
+        blocks : array of int, shape (n_events,)
+            The block of each.
+
+        Returns
+        -------
+        samples : array of int, shape (n_events,)
+            The MEG samples.
+        """
+        times = np.asarray(times, float)
+        idx = np.searchsorted(self.blocks, blocks)
+        if np.any(idx == len(self.blocks)) or \
+                np.any(self.blocks[idx % len(self.blocks)] != blocks):
+            raise ValueError('Some events are in blocks without an '
+                             'alignment.')
+        return np.rint(self.slopes[idx] * times +
+                       self.intercepts[idx]).astype(int)
+
+    def to_events(self, times, blocks, triggers):
+        """Convert EyeLink events to MEG events, sorted by sample."""
+        evts = np.zeros((len(times), 3), int)
+        evts[:, 0] = self.transform(times, blocks)
+        evts[:, 2] = triggers
+        return evts[np.argsort(evts[:, 0], kind='stable')]
+
+    def save(self, fname):
+        np.savez(fname, blocks=self.blocks, slopes=self.slopes,
+                 intercepts=self.intercepts, sfreq=self.sfreq,
+                 n_inliers=self.n_inliers, n_outliers=self.n_outliers,
+                 residuals=self.residuals)
+
+
+def read_alignment(fname):
+    """Read an alignment written by `ClockAlignment.save`."""
+    with np.load(fname) as FILE:
+        return ClockAlignment(**{key: FILE[key] for key in FILE.files})
+
+
+def _fit_block(times, samples, threshold, n_iter):
+    # center the times, the EyeLink clock is far from 0
+    t_mean = times.mean()
+    times = times - t_mean
+    order = np.argsort(times, kind='stable')
+    dt, ds = np.diff(times[order]), np.diff(samples[order])
+    slope = np.median(ds[dt > 0] / dt[dt > 0])
+    intercept = np.median(samples - slope * times)
+    inliers = np.ones(len(times), bool)
+    for _ in range(n_iter):
+        res = samples - (slope * times + intercept)
+        # the robust standard deviation, at least a sample
+        mad = 1.4826 * np.median(np.abs(res[inliers] -
+                                        np.median(res[inliers])))
+        inliers = np.abs(res) <= threshold * max(mad, 1.)
+        if inliers.sum() < 2:
+            raise ValueError('Fewer than 2 events are left to fit.')
+        design = np.column_stack((times[inliers], np.ones(inliers.sum())))
+        coef = np.linalg.lstsq(design, samples[inliers], rcond=None)[0]
+        if np.allclose(coef, (slope, intercept), rtol=0, atol=1e-9):
+            break
+        slope, intercept = coef
+    res = samples[inliers] - (slope * times[inliers] + intercept)
+    return (slope, intercept - slope * t_mean, inliers.sum(),
+            (~inliers).sum(), res.std())
+
+
+def fit_alignment(times, samples, blocks, sfreq, threshold=3., n_iter=10):
+    """Fit the alignment of the EyeLink and MEG clocks.
+
+    Parameters
+    ----------
+    times : array, shape (n_events,)
+        The EyeLink times of the shared events, in ms.
+    samples : array of int, shape (n_events,)
+        Their MEG samples.
+    blocks : array of int, shape (n_events,)
+        Their blocks.
+    sfreq : float
+        The sampling frequency of the MEG.
+    threshold : float
+        The events further from the line than `threshold` times the robust
+        standard deviation of the residuals are left out of the fit.
+    n_iter : int
+        The maximum number of iterations of the fit.
+
+    Returns
+    -------
+    alignment : instance of ClockAlignment
+        The alignment.
+    """
+    times = np.asarray(times, float)
+    samples = np.asarray(samples, float)
+    blocks = np.asarray(blocks, int)
+    unique_blocks = np.unique(blocks)
+    fits = [_fit_block(times[blocks == block], samples[blocks == block],
+                       threshold, n_iter) for block in unique_blocks]
+    slopes, intercepts, n_inliers, n_outliers, residuals = zip(*fits)
+    return ClockAlignment(unique_blocks, slopes, intercepts, sfreq, n_inliers,
+                          n_outliers, residuals)
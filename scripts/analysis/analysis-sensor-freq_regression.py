@@ -1,19 +1,18 @@
 import pickle
 import os.path as op
 import numpy as np
-import scipy as sp
 
-from sklearn.preprocessing import LabelEncoder, StandardScaler
-from sklearn.linear_model import Ridge
-from sklearn.pipeline import Pipeline
 from sklearn.cross_validation import KFold
 
 import mne
-from mne.decoding import GeneralizationAcrossTime
 from mne.stats import linear_regression
 
 import config
 from analysis_func import group_stats
+from _rebuild import is_stale, record
+from covariance import online_covariance
+from design_matrix import read_design_matrix
+from gat import ridge_gat
 
 
 # parameters
@@ -24,6 +23,7 @@ exp = 'OLDT'
 clf_name = 'ridge'
 reg_type = 'reg'
 c_name = 'freq'
+regressor = 'log_freq'
 analysis = '%s_%s_regression_sensor_analysis' % (c_name, clf_name)
 random_state = 42
 decim = 2
@@ -35,15 +35,11 @@ event_id = {'word/prime/unprimed': 1,
 reject = config.reject
 
 
-# classifier
-reg = Ridge(alpha=1e-3)  # Ridge Regression
-clf = Pipeline([('scaler', StandardScaler()), ('ridge', reg)])
+# classifier: a standardized ridge regression, see `gat`
+alpha = 1e-3
 
 # decoding parameters
 tmin, tmax = -.2, 1
-# smoothing window
-length = decim * 1e-3
-step = decim * 1e-3
 n_folds = 5
 
 # setup group
@@ -53,148 +49,101 @@ group_dict = dict()
 group_dict['subjects'] = subjects = config.subjects
 
 
-# Ranker function
-def rank_scorer(y, y_pred):
-    # because of dimensionality issues with the output of sklearn regression
-    # one needs to ravel
-    y = np.ravel(y)
-    y_pred = np.ravel(y_pred)
-    n = y.size
-    # get the total number of combinations
-    n_comb = sp.misc.comb(n, 2)
-
-    """
-    Comparisons
-    -----------
-    - You tile the `y` so you can have make all possible comparisons.
-    - When you transpose a copy of `y` and then subtract it,
-      you are now doing pairwise comparisons if each combination.
-    - The diagonal is a comparison with itself (remove), and above and below
-      are mirror of combinations, so you only need half of them.
-    """
-    y_compare = np.tile(y, (n, 1))
-    y_compare = y_compare - y_compare.T
-
-    # do the exact same thing for the y_pred
-    y_pred_compare = np.tile(y_pred, (n, 1))
-    y_pred_compare = y_pred_compare - y_pred_compare.T
-
-    # positive = correct prediction, negative = incorrect prediction
-    score = y_compare * y_pred_compare
-    # we need to remove the diagonal from the combinations
-    score = (score > 0).sum()/ (2 * n_comb)
-
-    return score
-
-if redo:
-    for subject in config.subjects:
-        print config.banner % subject
-        # define filenames
-        subject_template = op.join(path, subject, 'mne', subject + '_%s%s.%s')
-        fname_proj = subject_template % (exp, '_calm_' + filt + '_filt-proj', 'fif')
-        fname_raw = subject_template % (exp, '_calm_' + filt + '_filt-raw', 'fif')
-        fname_evts = subject_template % (exp, '_fixation_coreg-eve', 'txt')
-        fname_dm = subject_template % (exp, '_%s_design_matrix' % c_name, 'txt')
-        fname_gat = subject_template % (exp, '_calm_' + filt + '_filt_' + analysis
-                                        + '_gat', 'npy')
-        fname_reg = subject_template % (exp, '_calm_' + filt + '_filt_' + analysis
-                                        + '_reg-ave', 'fif')
-        fname_cov = subject_template % (exp, '_calm_' + filt + '_filt_' + analysis
-                                        + '_data-cov', 'fif')
-        fname_weights = subject_template % (exp, '_calm_' + filt + '_filt_'
-                                            + analysis + '_gat_weights', 'npy')
-        # loading events and raw
-        evts = mne.read_events(fname_evts)
-
-        # map word, then nonword
-        evts = mne.event.merge_events(evts, [1, 2, 5, 6], 99)
-        event_id = {'word': 99}
-
-        # loading design matrix, epochs, proj
-        design_matrix = np.loadtxt(fname_dm)
-        reg_names = ('intercept', c_name)
-
-        # # let's look at the time around the fixation
-        # durs = np.asarray(design_matrix[:, -1] * 1000, int)
-        # evts[:, 0] = evts[:, 0] + durs
-
-        raw = mne.io.read_raw_fif(fname_raw, preload=True, verbose=False)
-
-        # add/apply proj
-        proj = [mne.read_proj(fname_proj)[0]]
-        raw.add_proj(proj).apply_proj()
-        # select only meg channels
-        raw.pick_types(meg=True)
-
-        epochs = mne.Epochs(raw, evts, event_id, tmin=tmin, tmax=tmax,
-                            baseline=None, decim=decim, reject=reject,
-                            preload=True, verbose=False)
-
-        # epochs rejection: filtering
-        # drop based on MEG rejection, must happen first
-        epochs.drop_bad(reject=reject)
-        design_matrix = design_matrix[epochs.selection]
-        evts = evts[epochs.selection]
-        # remove nans
-        idx = np.logical_not(np.isnan(design_matrix[:, -1]))
-        epochs = epochs[idx]
-        design_matrix = design_matrix[idx]
-        evts = evts[idx]
-        # remove zeros
-        idx = design_matrix[:, -1] > 0
-        epochs = epochs[idx]
-        design_matrix = design_matrix[idx]
-        evts = evts[idx]
-
-        # rerf keys
-        dm_keys = evts[:, 0]
-
-        assert len(design_matrix) == len(epochs) == len(dm_keys)
-        # group_ols[subject] = epochs.average()
-        # Define 'y': what you're predicting
-        y = design_matrix[:, -1]
-
-        # run a rERF
-        covariates = dict(zip(dm_keys, y))
-        # linear regression
-        reg = linear_regression(epochs, design_matrix, reg_names)
-        reg[c_name].beta.save(fname_reg)
-
-        print 'get ready for decoding ;)'
-        train_times = {'start': tmin,
-                       'stop': tmax,
-                       'length': length,
-                       'step': step
-                       }
-        cv = KFold(n=len(y), n_folds=n_folds, random_state=random_state)
-        gat = GeneralizationAcrossTime(predict_mode='cross-validation', n_jobs=1,
-                                       train_times=train_times, scorer=rank_scorer,
-                                       clf=clf, cv=cv)
-        gat.fit(epochs, y=y)
-        gat.score(epochs, y=y)
-        print gat.scores_.shape
-        np.save(fname_gat, gat.scores_)
-
-        # store weights
-        weights = list()
-        for fold in range(n_folds):
-            # weights explained: gat.estimator_[time_point][fold].steps[-1][-1].coef_
-            weights.append(np.vstack([gat.estimators_[idx][fold].steps[-1][-1].coef_
-                                      for idx in range(len(epochs.times))]))
-        np.save(fname_weights, np.array(weights))
-        cov = mne.compute_covariance(epochs)
-        cov.save(fname_cov)
-
-    # define a layout
-    layout = mne.find_layout(epochs.info)
-    # additional properties
-    group_dict['layout'] = layout
-    group_dict['times'] = epochs.times
-    group_dict['sfreq'] = epochs.info['sfreq']
-
-else:
-    group_dict = pickle.load(open(fname_group))
-    subjects = group_dict['subjects']
+for subject in config.subjects:
+    print(config.banner % subject)
+    # define filenames
+    subject_template = op.join(path, subject, 'mne', subject + '_%s%s.%s')
+    fname_proj = subject_template % (exp, '_calm_' + filt + '_filt-proj', 'fif')
+    fname_raw = subject_template % (exp, '_calm_' + filt + '_filt-raw', 'fif')
+    fname_evts = subject_template % (exp, '_fixation_coreg-eve', 'txt')
+    fname_dm = subject_template % (exp, '_fixation_design_matrix', 'npz')
+    fname_gat = subject_template % (exp, '_calm_' + filt + '_filt_' + analysis
+                                    + '_gat', 'npy')
+    fname_reg = subject_template % (exp, '_calm_' + filt + '_filt_' + analysis
+                                    + '_reg-ave', 'fif')
+    fname_cov = subject_template % (exp, '_calm_' + filt + '_filt_' + analysis
+                                    + '_data-cov', 'fif')
+    fname_weights = subject_template % (exp, '_calm_' + filt + '_filt_'
+                                        + analysis + '_gat_weights', 'npy')
+    outputs = [fname_gat, fname_weights, fname_reg, fname_cov]
+    inputs = [fname_raw, fname_evts, fname_dm, fname_proj]
+    params = dict(analysis=analysis, tmin=tmin, tmax=tmax, decim=decim,
+                  reject=reject, clf=clf_name, alpha=alpha, n_folds=n_folds,
+                  random_state=random_state)
+    if not is_stale(outputs, inputs, params, force=redo):
+        continue
+
+    # loading events and raw
+    evts = mne.read_events(fname_evts)
+
+    # map word, then nonword
+    evts = mne.event.merge_events(evts, [1, 2, 5, 6], 99)
+    event_id = {'word': 99}
+
+    # loading design matrix, epochs, proj
+    design_matrix = read_design_matrix(fname_dm).select([regressor])
+    reg_names = ('intercept', c_name)
+
+    # # let's look at the time around the fixation
+    # durs = np.asarray(design_matrix[:, -1] * 1000, int)
+    # evts[:, 0] = evts[:, 0] + durs
+
+    raw = mne.io.read_raw_fif(fname_raw, preload=True, verbose=False)
+
+    # add/apply proj
+    proj = [mne.read_proj(fname_proj)[0]]
+    raw.add_proj(proj).apply_proj()
+    # select only meg channels
+    raw.pick_types(meg=True)
+
+    epochs = mne.Epochs(raw, evts, event_id, tmin=tmin, tmax=tmax,
+                        baseline=None, decim=decim, reject=reject,
+                        preload=True, verbose=False)
+
+    # epochs rejection: filtering
+    # drop based on MEG rejection, must happen first
+    epochs.drop_bad(reject=reject)
+    design_matrix = design_matrix[epochs.selection]
+    evts = evts[epochs.selection]
+    # remove nans
+    idx = np.logical_not(np.isnan(design_matrix[:, -1]))
+    epochs = epochs[idx]
+    design_matrix = design_matrix[idx]
+    evts = evts[idx]
+    # remove zeros
+    idx = design_matrix[:, -1] > 0
+    epochs = epochs[idx]
+    design_matrix = design_matrix[idx]
+    evts = evts[idx]
+
+    # rerf keys
+    dm_keys = evts[:, 0]
+
+    assert len(design_matrix) == len(epochs) == len(dm_keys)
+    # group_ols[subject] = epochs.average()
+    # Define 'y': what you're predicting
+    y = design_matrix[:, -1]
+
+    # run a rERF
+    covariates = dict(zip(dm_keys, y))
+    # linear regression
+    reg = linear_regression(epochs, design_matrix, reg_names)
+    reg[c_name].beta.save(fname_reg)
+
+    print('get ready for decoding ;)')
+
+    cv = KFold(n=len(y), n_folds=n_folds, random_state=random_state)
+    # all the training times of a fold are fitted at once
+    scores, weights = ridge_gat(epochs.get_data(), y, cv, alpha=alpha)
+    print(scores.shape)
+    np.save(fname_gat, scores)
+
+    # store weights
+    # weights explained: (fold, time point, channel), on the standardized data
+    np.save(fname_weights, weights)
+    cov = online_covariance(epochs, n_jobs=config.n_jobs)
+    cov.save(fname_cov)
+    record(outputs, inputs, params)
 
 ####################
 # Group Statistics #
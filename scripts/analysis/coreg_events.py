@@ -0,0 +1,80 @@
+"""
+Co-registered Events
+--------------------
+The eye tracking measures are co-registered with the MEG by their trial and
+trigger. Rather than looking up the MEG trial of each eye tracking row, the
+two tables are joined on (trial, trigger) as whole columns, and the design
+matrix and the events of the matched rows are written together.
+"""
+import numpy as np
+from pandas import read_table
+from mne import write_events
+
+from _trial_struct import read_trial_struct
+
+
+keys = ['trial', 'trigger']
+
+
+def coreg_events(meg_ds, em_ds, regressors):
+    """Join the eye tracking rows with the MEG trials.
+
+    Parameters
+    ----------
+    meg_ds : DataFrame
+        The MEG trial structure, see `_trial_struct`. The fixation triggers
+        are left out, and of the trials with the same trial and trigger,
+        the last one is used.
+    em_ds : DataFrame
+        The eye tracking measures, with a `trial` and a `trigger` column.
+    regressors : list of str
+        The columns of `em_ds` in the design matrix.
+
+    Returns
+    -------
+    design_matrix : array, shape (n_matched, 1 + n_regressors)
+        The intercept and the regressors of the matched rows, in the order
+        of `em_ds`.
+    evts : array of int, shape (n_matched, 3)
+        Their events.
+    unmatched : dict
+        The number of eye tracking rows ('em') and of MEG trials ('meg')
+        without a match.
+    """
+    meg_ds = meg_ds[meg_ds['trigger'] != 128]
+    meg_ds = meg_ds.drop_duplicates(keys, keep='last')[keys + ['i_start']]
+    # a left join keeps the order of the eye tracking rows
+    merged = em_ds[keys + regressors].merge(meg_ds, on=keys, how='left',
+                                            indicator=True)
+    matched = (merged['_merge'] == 'both').values
+    merged = merged[matched]
+    em_keys = em_ds[keys].drop_duplicates()
+    meg_matched = meg_ds[keys].merge(em_keys, on=keys, how='left',
+                                     indicator=True)['_merge'] == 'both'
+
+    design_matrix = np.column_stack([np.ones(len(merged))] +
+                                    [merged[regressor].values
+                                     for regressor in regressors])
+    evts = np.zeros((len(merged), 3), int)
+    evts[:, 0] = merged['i_start'].values
+    evts[:, 2] = merged['trigger'].values
+    unmatched = dict(em=int((~matched).sum()),
+                     meg=int((~meg_matched.values).sum()))
+    return design_matrix, evts, unmatched
+
+
+def make_coreg(fname_meg, fname_em, regressors, fname_dm, fname_eve):
+    """Co-register a subject and write its design matrix and events.
+
+    Returns
+    -------
+    unmatched : dict
+        The number of eye tracking rows ('em') and of MEG trials ('meg')
+        without a match.
+    """
+    meg_ds = read_trial_struct(fname_meg)
+    em_ds = read_table(fname_em, sep=',')
+    design_matrix, evts, unmatched = coreg_events(meg_ds, em_ds, regressors)
+    np.savetxt(fname_dm, design_matrix, fmt='%s', delimiter='\t')
+    write_events(fname_eve, evts)
+    return unmatched
@@ -0,0 +1,333 @@
+"""
+Online Covariance
+-----------------
+Computes noise and data covariances from the sufficient statistics of the
+data: the number of samples, the mean and the centered cross-products,
+plus the fourth moments the Ledoit-Wolf shrinkage needs. The statistics
+are accumulated over epochs or raw segments as they are read, so the
+memory does not grow with the recording, and the accumulators of parallel
+workers are merged with the pairwise formulas of Chan et al. The estimator
+is only chosen at the end.
+
+The shrinkage coefficients are those of sklearn, with the data assumed
+centered as in `mne.compute_covariance`, or not as in
+`mne.compute_raw_covariance`:
+
+    empirical : the sample covariance, normalized by n - 1 as in MNE.
+    shrunk : shrunk towards the scaled identity by a fixed `shrinkage`.
+    ledoit_wolf, oas : shrunk by the Ledoit-Wolf or OAS coefficient.
+    regularize : the sample covariance, passed to `mne.cov.regularize`.
+    auto : the best of the above (but 'regularize') by the cross-validated
+        log-likelihood over the folds of the epochs, which are kept
+        separately if `n_folds` > 1.
+
+Unlike MNE, the estimators are applied to the full covariance, not in the
+subspace of the data if it is rank deficient.
+"""
+import numpy as np
+
+import mne
+from mne.parallel import parallel_func
+
+
+class OnlineCovariance(object):
+    """Accumulate the sufficient statistics of a covariance.
+
+    Parameters
+    ----------
+    n_channels : int
+        The number of channels.
+    n_folds : int
+        The number of folds the epochs are dealt into, round-robin, for
+        `method='auto'`.
+    """
+    def __init__(self, n_channels, n_folds=1):
+        self.n_channels = n_channels
+        self.n_folds = n_folds
+        self.n_epochs = 0
+        # the statistics of each fold
+        self.n = np.zeros(n_folds)
+        self.mean = np.zeros((n_folds, n_channels))
+        self.m2 = np.zeros((n_folds, n_channels, n_channels))
+        # sums of |x|^4 and |x|^2 x, for the Ledoit-Wolf shrinkage
+        self.s4 = np.zeros(n_folds)
+        self.s3 = np.zeros((n_folds, n_channels))
+
+    def _add(self, fold, data):
+        # data, shape (n_channels, n_samples)
+        n = data.shape[1]
+        if n == 0:
+            return
+        mean = data.mean(axis=1)
+        centered = data - mean[:, np.newaxis]
+        norms = (data ** 2).sum(axis=0)
+        stats = (np.array([n]), mean[np.newaxis],
+                 centered.dot(centered.T)[np.newaxis],
+                 np.array([(norms ** 2).sum()]), data.dot(norms)[np.newaxis])
+        idx = slice(fold, fold + 1)
+        self._merge_stats(idx, *stats)
+
+    def _merge_stats(self, idx, n, mean, m2, s4, s3):
+        n_a, n_b = self.n[idx], n
+        n_ab = n_a + n_b
+        delta = mean - self.mean[idx]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratio = np.where(n_ab > 0, n_b / n_ab, 0.)
+        self.m2[idx] += m2 + (delta[:, :, np.newaxis] * delta[:, np.newaxis] *
+                              (n_a * ratio)[:, np.newaxis, np.newaxis])
+        self.mean[idx] += delta * ratio[:, np.newaxis]
+        self.n[idx] = n_ab
+        self.s4[idx] += s4
+        self.s3[idx] += s3
+
+    def update(self, data, first_epoch=None):
+        """Add data to the statistics.
+
+        Parameters
+        ----------
+        data : array, shape (n_epochs, n_channels, n_times) | (n_channels, n_times)
+            Epochs, or a raw segment, counted as one epoch.
+        first_epoch : None | int
+            The index of the first epoch in the recording, which sets the
+            folds of the epochs. If None, the epochs follow the ones added
+            before.
+        """
+        if data.ndim == 2:
+            data = data[np.newaxis]
+        if first_epoch is None:
+            first_epoch = self.n_epochs
+        folds = (first_epoch + np.arange(len(data))) % self.n_folds
+        for fold in np.unique(folds):
+            self._add(fold, np.hstack(data[folds == fold]))
+        self.n_epochs += len(data)
+        return self
+
+    def merge(self, other):
+        """Merge the statistics of another accumulator, fold by fold."""
+        if (other.n_channels, other.n_folds) != (self.n_channels,
+                                                 self.n_folds):
+            raise ValueError('Cannot merge accumulators of different shapes.')
+        self._merge_stats(slice(None), other.n, other.mean, other.m2,
+                          other.s4, other.s3)
+        self.n_epochs += other.n_epochs
+        return self
+
+    def _pool(self, folds):
+        # the statistics of some folds, pooled
+        pooled = OnlineCovariance(self.n_channels)
+        for fold in folds:
+            idx = slice(fold, fold + 1)
+            pooled._merge_stats(slice(None), self.n[idx], self.mean[idx],
+                                self.m2[idx], self.s4[idx], self.s3[idx])
+        return pooled
+
+    def scatter(self, assume_centered=True, mean=None):
+        """The sum of the cross-products around a mean, over all folds."""
+        pooled = self._pool(range(self.n_folds))
+        if mean is None:
+            mean = 0. if assume_centered else pooled.mean[0]
+        delta = pooled.mean[0] - mean
+        return pooled.m2[0] + pooled.n[0] * np.outer(delta, delta)
+
+    def covariance(self, method='empirical', shrinkage=.1,
+                   assume_centered=True):
+        """Estimate the covariance.
+
+        Returns
+        -------
+        cov : array, shape (n_channels, n_channels)
+            The estimate.
+        shrinkage : float
+            The shrinkage applied, 0 for the empirical covariance.
+        """
+        pooled = self._pool(range(self.n_folds))
+        n, p = pooled.n[0], self.n_channels
+        scatter = self.scatter(assume_centered)
+        # the coefficients are those of sklearn, which divides by n
+        emp = scatter / n
+        mu = np.trace(emp) / p
+        if method == 'empirical':
+            shrinkage = 0.
+        elif method == 'shrunk':
+            pass
+        elif method == 'ledoit_wolf':
+            shrinkage = self._ledoit_wolf_shrinkage(pooled, emp, mu,
+                                                    assume_centered)
+        elif method == 'oas':
+            alpha = np.mean(emp ** 2)
+            num = alpha + mu ** 2
+            den = (n + 1.) * (alpha - mu ** 2 / p)
+            shrinkage = 1. if den == 0 else min(num / den, 1.)
+        else:
+            raise ValueError("method must be 'empirical', 'shrunk', "
+                             "'ledoit_wolf' or 'oas', not %s." % method)
+        # and the covariance that of MNE, which divides by n - 1
+        emp = scatter / (n - 1)
+        mu = np.trace(emp) / p
+        cov = (1. - shrinkage) * emp
+        cov.flat[::p + 1] += shrinkage * mu
+        return cov, shrinkage
+
+    def _ledoit_wolf_shrinkage(self, pooled, emp, mu, assume_centered):
+        n, p = pooled.n[0], self.n_channels
+        mean = pooled.mean[0]
+        # sum of |x - m|^4, expanded over the sums of the raw moments
+        s4 = pooled.s4[0]
+        if not assume_centered:
+            second = pooled.m2[0] + n * np.outer(mean, mean)
+            m_norm = mean.dot(mean)
+            sum_norm2 = np.trace(second)
+            s4 = (s4 - 4 * mean.dot(pooled.s3[0]) +
+                  4 * mean.dot(second).dot(mean) + 2 * m_norm * sum_norm2 -
+                  4 * m_norm * n * m_norm + n * m_norm ** 2)
+        delta_ = np.sum(emp ** 2)
+        beta = (s4 / n - delta_) / (p * n)
+        delta = (delta_ - 2. * mu * np.trace(emp) + p * mu ** 2) / p
+        beta = min(beta, delta)
+        return 0. if beta == 0 else beta / delta
+
+    def log_likelihood(self, cov, mean=None):
+        """The average Gaussian log-likelihood of the samples under a model."""
+        pooled = self._pool(range(self.n_folds))
+        sign, logdet = np.linalg.slogdet(cov)
+        if sign <= 0:
+            return -np.inf
+        scatter = self.scatter(mean is None, mean)
+        p = self.n_channels
+        return -.5 * (p * np.log(2 * np.pi) + logdet +
+                      np.trace(np.linalg.solve(cov, scatter)) / pooled.n[0])
+
+    def _auto(self, methods, shrinkages, assume_centered):
+        if self.n_folds < 2:
+            raise ValueError("method='auto' needs n_folds > 1.")
+        candidates = [(method, None) for method in methods] + \
+            [('shrunk', shrinkage) for shrinkage in shrinkages]
+        scores = np.zeros(len(candidates))
+        for fold in range(self.n_folds):
+            train = self._pool(np.setdiff1d(range(self.n_folds), [fold]))
+            test = self._pool([fold])
+            mean = None if assume_centered else train.mean[0]
+            for ii, (method, shrinkage) in enumerate(candidates):
+                cov = train.covariance(method, shrinkage, assume_centered)[0]
+                scores[ii] += test.log_likelihood(cov, mean) / self.n_folds
+        return candidates[np.argmax(scores)], scores.max()
+
+    def finalize(self, info, method='empirical', shrinkage=.1,
+                 assume_centered=True, **kwargs):
+        """Make the covariance.
+
+        Parameters
+        ----------
+        info : instance of Info
+            The measurement info of the channels the data are on.
+        method : str
+            The estimator, see the module docstring.
+        shrinkage : float
+            The shrinkage of `method='shrunk'`.
+        assume_centered : bool
+            If True, the cross-products are taken around 0, as
+            `mne.compute_covariance`, otherwise around the mean.
+        **kwargs
+            The arguments of `mne.cov.regularize`.
+
+        Returns
+        -------
+        cov : instance of Covariance
+            The covariance.
+        """
+        loglik = None
+        if method == 'auto':
+            (method, shrinkage), loglik = self._auto(
+                ('empirical', 'ledoit_wolf', 'oas'), np.logspace(-4, 0, 30),
+                assume_centered)
+        estimator = 'empirical' if method == 'regularize' else method
+        data, shrinkage = self.covariance(estimator, shrinkage,
+                                          assume_centered)
+        n = self._pool(range(self.n_folds)).n[0]
+        cov = mne.Covariance(data, info['ch_names'], info['bads'],
+                             info['projs'], int(n) - 1, method=method,
+                             loglik=loglik)
+        if method == 'regularize':
+            cov = mne.cov.regularize(cov, info, **kwargs)
+        return cov
+
+
+def _accumulate(data, picks, n_channels, n_folds, first_epoch):
+    return OnlineCovariance(n_channels, n_folds).update(data[:, picks],
+                                                        first_epoch)
+
+
+def online_covariance(epochs, method='empirical', n_folds=None, n_jobs=1,
+                      chunk_size=50, **kwargs):
+    """Compute the covariance of epochs, chunk by chunk.
+
+    Parameters
+    ----------
+    epochs : instance of Epochs
+        The epochs. If they are preloaded, e.g. memory-mapped from the
+        epochs cache, the workers read their chunks from them, otherwise
+        the epochs are read one chunk at a time.
+    method : str
+        The estimator, see `OnlineCovariance.finalize`.
+    n_folds : None | int
+        The number of folds. If None, 3 for `method='auto'`, otherwise 1.
+    n_jobs : int
+        The number of jobs, over the chunks of epochs.
+    chunk_size : int
+        The number of epochs in a chunk.
+    **kwargs
+        The other arguments of `OnlineCovariance.finalize`.
+
+    Returns
+    -------
+    cov : instance of Covariance
+        The covariance, over the data channels but the bad ones.
+    """
+    if n_folds is None:
+        n_folds = 3 if method == 'auto' else 1
+    picks = mne.pick_types(epochs.info, meg=True, eeg=True, ref_meg=False,
+                           exclude='bads')
+    n_epochs = len(epochs.events)
+    if epochs.preload:
+        data = epochs.get_data()
+        chunks = ((data[start:start + chunk_size], start)
+                  for start in range(0, n_epochs, chunk_size))
+    else:
+        chunks = ((epochs[start:start + chunk_size].get_data(), start)
+                  for start in range(0, n_epochs, chunk_size))
+    parallel, p_fun, _ = parallel_func(_accumulate, n_jobs)
+    accumulators = parallel(p_fun(chunk, picks, len(picks), n_folds, start)
+                            for chunk, start in chunks)
+    accumulator = OnlineCovariance(len(picks), n_folds)
+    for other in accumulators:
+        accumulator.merge(other)
+    info = mne.pick_info(epochs.info, picks)
+    return accumulator.finalize(info, method, **kwargs)
+
+
+def raw_covariance(raw, tmin=0, tmax=None, segment_duration=10.,
+                   method='empirical', **kwargs):
+    """Compute the covariance of a raw, reading it segment by segment.
+
+    The data are centered, as in `mne.compute_raw_covariance`, and the
+    segments annotated as bad are omitted.
+
+    Returns
+    -------
+    cov : instance of Covariance
+        The covariance, over the data channels but the bad ones.
+    """
+    picks = mne.pick_types(raw.info, meg=True, eeg=True, ref_meg=False,
+                           exclude='bads')
+    start = raw.time_as_index(tmin)[0]
+    # the stop is exclusive, so by default the last sample is included
+    stop = len(raw.times) if tmax is None else raw.time_as_index(tmax)[0]
+    n_segment = int(round(segment_duration * raw.info['sfreq']))
+    accumulator = OnlineCovariance(len(picks))
+    for first in range(start, stop, n_segment):
+        accumulator.update(raw.get_data(picks, first,
+                                        min(first + n_segment, stop),
+                                        reject_by_annotation='omit'))
+    info = mne.pick_info(raw.info, picks)
+    kwargs.setdefault('assume_centered', False)
+    return accumulator.finalize(info, method, **kwargs)
@@ -1,40 +1,35 @@
 from pyeparse.reading import Reading
 
+from edf_cache import read_raw_cached
+
 
 class CustomReading(Reading):
-    def _define_ffix_nogaze(self):
-        max_pos = self._define_max_pos()
-        data = self._data
-        # initializing
-        ffix_nogaze = np.zeros((len(self._data), 1), int)
-        ffix_nogaze[0] = 1
-        ffix_ias = np.zeros((self.n_ias, 1))
-        ref_trial = data.iloc[0]['trial']
+    """A `Reading` whose EDF is read through the cache, see `edf_cache`."""
+    def __init__(self, raw, *args, **kwargs):
+        if isinstance(raw, str):
+            raw = read_raw_cached(raw)
+        super(CustomReading, self).__init__(raw, *args, **kwargs)
 
-        for idx in range(1, len(data)):
-            meas = data.iloc[idx]
-            prev_meas = data.iloc[idx - 1]
-            if meas['trial'] > ref_trial:
-                ffix_ias = np.zeros((self.n_ias, 1), int)
-                ref_trial = meas['trial']
-            if ffix_ias[meas['fix_pos'].astype(int)] == 0:
-                ffix_ias[meas['fix_pos'].astype(int)] = 1
-                ffix_nogaze[idx] = 1
+    def _define_ffix_nogaze(self):
+        """Flag the first fixation in each interest area of each trial."""
+        if getattr(self, '_ffix_nogaze', None) is None:
+            first = ~self._data.duplicated(subset=['trial', 'fix_pos'])
+            self._ffix_nogaze = first.values.astype(int)
+        return self._ffix_nogaze
 
-        return ffix_nogaze
+    def get_ffix_nogaze_durations(self):
+        """Get the first fixations of all the interest areas, by trial."""
+        if getattr(self, '_ffix_nogaze_durations', None) is None:
+            data = self._data[self._define_ffix_nogaze() == 1]
+            # there is one first fixation per trial and interest area
+            data = data.groupby(by=['trial', 'fix_pos'], as_index=False,
+                                sort=True).first()
+            self._ffix_nogaze_durations = data
+        return self._ffix_nogaze_durations
 
     def get_ffix_nogaze_duration(self, ia):
-        labels = self._data.columns.get_values()
-        ffix_nogaze = self._define_ffix_nogaze()
-        data = map(DataFrame, [ffix_nogaze])
-        data.insert(0, self._data)
-        labels = np.hstack((labels, ['ffix_nogaze']))
-        data = concat(data, axis=1)
-        data.columns = labels
-
-        data = self._data[self._data['ffix_nogaze'] == 1]
+        data = self.get_ffix_nogaze_durations()
         data = data[data['fix_pos'] == ia]
-        data = data.groupby(by=['trial'], as_index=False).mean()
         data = data.reset_index(drop=True)
 
         return data
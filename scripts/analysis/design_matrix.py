@@ -0,0 +1,130 @@
+"""
+Design Matrix
+-------------
+The regression analyses all regress the MEG on a measure of the fixation
+times table: the first fixation duration, the bigram mean, the log
+frequency, ... Rather than writing a design matrix per measure, the table
+is co-registered with the MEG once per subject (see `coreg_events`), and
+every regressor of the matched rows is kept, with its own type, in one
+`.npz`. The analyses then select their columns in memory.
+"""
+import numpy as np
+from pandas import read_table
+
+from mne import write_events
+
+from _trial_struct import read_trial_struct
+from _rebuild import is_stale, record
+from coreg_events import coreg_events
+
+
+# the regressors, and their type. `ffd` is the first fixation duration,
+# `dur` the gaze duration and `length` the length of the string. Those that
+# are not in the fixation times table are left out
+regressors = dict(ffd=float, dur=float, bg_mean=float, log_freq=float,
+                  length=int, priming=int, word=int)
+
+
+class DesignMatrix(object):
+    """The regressors of the co-registered rows of a subject.
+
+    Parameters
+    ----------
+    columns : dict of array, shape (n_rows,)
+        The regressors.
+    evts : array of int, shape (n_rows, 3)
+        The events of the rows.
+    """
+    def __init__(self, columns, evts):
+        self.columns = columns
+        self.evts = evts
+
+    def __repr__(self):
+        return '<DesignMatrix | %d rows, %s>' % (len(self.evts),
+                                                 ', '.join(self.columns))
+
+    def __len__(self):
+        return len(self.evts)
+
+    def mask(self, names):
+        """Get the rows with a value for all the regressors `names`."""
+        mask = np.ones(len(self), bool)
+        for name in names:
+            if self.columns[name].dtype.kind == 'f':
+                mask &= ~np.isnan(self.columns[name])
+        return mask
+
+    def select(self, names, zscore=False, intercept=True):
+        """Get the matrix of some regressors.
+
+        Parameters
+        ----------
+        names : list of str
+            The regressors.
+        zscore : bool
+            If True, the regressors are z-scored, ignoring the missing
+            values.
+        intercept : bool
+            If True, the first column is the intercept.
+
+        Returns
+        -------
+        design_matrix : array, shape (n_rows, n_regressors + intercept)
+            The matrix. The missing values are NaN, see `mask`.
+        """
+        columns = [self.columns[name].astype(float) for name in names]
+        if zscore:
+            columns = [(column - np.nanmean(column)) / np.nanstd(column)
+                       for column in columns]
+        if intercept:
+            columns.insert(0, np.ones(len(self)))
+        return np.column_stack(columns)
+
+
+def make_design_matrix(fname_meg, fname_em, fname_dm, fname_eve, redo=False):
+    """Make the design matrix of a subject, if it is out of date.
+
+    Parameters
+    ----------
+    fname_meg : str
+        The MEG trial structure.
+    fname_em : str
+        The fixation times table.
+    fname_dm : str
+        The `.npz` of the design matrix.
+    fname_eve : str
+        The co-registered events.
+    redo : bool
+        If True, make the matrix again.
+
+    Returns
+    -------
+    unmatched : None | dict
+        The number of eye tracking rows ('em') and of MEG trials ('meg')
+        without a match, or None if the matrix was up to date.
+    """
+    inputs = [fname_meg, fname_em]
+    params = dict(regressors=sorted(regressors))
+    if not is_stale([fname_dm, fname_eve], inputs, params, force=redo):
+        return None
+
+    meg_ds = read_trial_struct(fname_meg)
+    em_ds = read_table(fname_em, sep=',')
+    em_ds['length'] = em_ds['string'].astype(str).str.len()
+    names = [name for name in regressors if name in em_ds]
+    design_matrix, evts, unmatched = coreg_events(meg_ds, em_ds, names)
+    columns = {name: design_matrix[:, ii + 1].astype(regressors[name])
+               for ii, name in enumerate(names)}
+    np.savez(fname_dm, evts=evts, **columns)
+    write_events(fname_eve, evts)
+    record([fname_dm, fname_eve], inputs, params)
+    return unmatched
+
+
+def read_design_matrix(fname):
+    """Read the design matrix written by `make_design_matrix`."""
+    with np.load(fname) as FILE:
+        columns = {name: FILE[name] for name in regressors
+                   if name in FILE}
+        evts = FILE['evts']
+    return DesignMatrix(columns, evts)
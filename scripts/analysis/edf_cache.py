@@ -0,0 +1,120 @@
+"""
+EDF Cache
+---------
+Parsing an EDF is slow, and 101a and 101b parse the same files on every
+run. The cache parses an EDF once and keeps its samples, times and discrete
+events (fixations, saccades, blinks, messages, ...) as typed `.npy` arrays,
+under `cache` next to the EDF. The other attributes of the raw go into a
+pickle. Reading from the cache memory-maps the arrays: the samples are
+only read from the disk when they are used.
+
+A cache entry is rebuilt when the content of the EDF changed (see
+`_rebuild`).
+"""
+import os
+import os.path as op
+import pickle
+import numpy as np
+
+import pyeparse as pp
+
+from _rebuild import is_stale, record
+
+
+def get_cache_path(fname):
+    """Get the cache directory of an EDF."""
+    return op.join(op.dirname(fname), 'cache',
+                   op.splitext(op.basename(fname))[0])
+
+
+def _to_typed(data):
+    # the strings, e.g. of the messages, are stored with a fixed width, so
+    # that the array can be memory-mapped
+    object_fields = list()
+    if data.dtype.names is None:
+        return data, object_fields
+    dtype = list()
+    for name in data.dtype.names:
+        column = data[name]
+        if column.dtype == object:
+            object_fields.append(name)
+            column = np.array(column.tolist())
+        dtype.append((name, column.dtype))
+    typed = np.empty(len(data), dtype)
+    for name in data.dtype.names:
+        typed[name] = data[name]
+    return typed, object_fields
+
+
+def _from_typed(data, object_fields):
+    if not object_fields:
+        return data
+    dtype = [(name, object if name in object_fields else data.dtype[name])
+             for name in data.dtype.names]
+    out = np.empty(len(data), dtype)
+    for name in data.dtype.names:
+        out[name] = data[name].tolist() if name in object_fields \
+            else data[name]
+    return out
+
+
+def write_raw_cache(raw, path):
+    """Write the arrays and the attributes of a raw to a cache directory."""
+    if not op.isdir(path):
+        os.makedirs(path)
+    attrs, arrays, discrete = dict(), list(), dict()
+    for key, value in raw.__dict__.items():
+        if key == 'discrete':
+            for kind, data in value.items():
+                data, object_fields = _to_typed(np.asarray(data))
+                np.save(op.join(path, 'discrete-%s.npy' % kind), data)
+                discrete[kind] = object_fields
+        elif isinstance(value, np.ndarray) and value.dtype != object:
+            np.save(op.join(path, '%s.npy' % key), value)
+            arrays.append(key)
+        else:
+            attrs[key] = value
+    with open(op.join(path, 'raw.pkl'), 'wb') as FILE:
+        pickle.dump(dict(cls=type(raw), attrs=attrs, arrays=arrays,
+                         discrete=discrete), FILE)
+
+
+def read_raw_cache(path):
+    """Read a raw from a cache directory, the arrays memory-mapped."""
+    with open(op.join(path, 'raw.pkl'), 'rb') as FILE:
+        meta = pickle.load(FILE)
+    raw = meta['cls'].__new__(meta['cls'])
+    raw.__dict__.update(meta['attrs'])
+    for key in meta['arrays']:
+        # copy on write, the raw may modify its arrays in place
+        setattr(raw, key, np.load(op.join(path, '%s.npy' % key),
+                                  mmap_mode='c'))
+    raw.discrete = dict()
+    for kind, object_fields in meta['discrete'].items():
+        data = np.load(op.join(path, 'discrete-%s.npy' % kind),
+                       mmap_mode=None if object_fields else 'c')
+        raw.discrete[kind] = _from_typed(data, object_fields)
+    return raw
+
+
+def read_raw_cached(fname, redo=False):
+    """Read an EDF, through the cache.
+
+    Parameters
+    ----------
+    fname : str
+        The EDF.
+    redo : bool
+        If True, parse the EDF again.
+
+    Returns
+    -------
+    raw : instance of pyeparse Raw
+        The raw, with its samples memory-mapped.
+    """
+    path = get_cache_path(fname)
+    fname_meta = op.join(path, 'raw.pkl')
+    if is_stale(fname_meta, [fname], dict(), force=redo):
+        write_raw_cache(pp.read_raw(fname), path)
+        record(fname_meta, [fname], dict())
+    return read_raw_cache(path)
@@ -0,0 +1,158 @@
+"""
+EDF Messages
+------------
+The experiment writes the variables of each trial as `!V TRIAL_VAR`
+messages in the EDF. Rather than searching the messages once per variable,
+and parsing the matches one by one, the messages of a raw are scanned once:
+the trial variables are split with a compiled pattern into typed columns
+(the name, the value and the time of each) that are then queried with
+array operations. The other messages, e.g. the `TTL` message sent with
+each MEG trigger, are kept too, to look up their times by trial.
+"""
+import re
+import numpy as np
+
+
+_trial_var = re.compile(r'^!V TRIAL_VAR (\S+) (.*)$')
+_trial_id = re.compile(r'^TRIALID\b')
+
+
+def _decode(msg):
+    if isinstance(msg, bytes):
+        msg = msg.decode('ascii', 'replace')
+    return msg.strip()
+
+
+class MessageIndex(object):
+    """The index of the trial variables of a raw.
+
+    Parameters
+    ----------
+    raw : instance of pyeparse Raw
+        The raw.
+
+    Attributes
+    ----------
+    names : array of str, shape (n_vars,)
+        The name of each trial variable message.
+    values : array of str, shape (n_vars,)
+        Its value.
+    times : array of float, shape (n_vars,)
+        Its time, in s.
+    trials : array of int, shape (n_vars,)
+        The trial it belongs to, from the `TRIALID` messages before it, or
+        -1 if it is before the first trial.
+    """
+    def __init__(self, raw):
+        messages = raw.discrete['messages']
+        msgs = [_decode(msg) for msg in messages['msg']]
+        stimes = np.asarray(messages['stime'], float)
+        # the single pass over the messages
+        matches = [_trial_var.match(msg) for msg in msgs]
+        is_var = np.array([match is not None for match in matches], bool)
+        is_trial = np.array([_trial_id.match(msg) is not None
+                             for msg in msgs], bool)
+        matches = [match for match in matches if match is not None]
+        self.names = np.array([match.group(1) for match in matches], str)
+        self.values = np.array([match.group(2).strip() for match in matches],
+                               str)
+        self.times = stimes[is_var]
+        self.trials = np.searchsorted(stimes[is_trial], self.times,
+                                      side='right') - 1
+        # all the messages, keyed by their trial, for `find_times`
+        msg_trials = np.searchsorted(stimes[is_trial], stimes,
+                                     side='right') - 1
+        keys = np.char.add(np.char.add(msg_trials.astype(str), ' '),
+                           np.array(msgs, str))
+        order = np.argsort(keys, kind='stable')
+        self._keys, self._key_times = keys[order], stimes[order]
+
+    def __repr__(self):
+        return '<MessageIndex | %d trial variables, %d messages>' % (
+            len(self.unique_names), len(self.names))
+
+    @property
+    def unique_names(self):
+        """The names of the trial variables, sorted."""
+        return np.unique(self.names)
+
+    def get(self, name, dtype=str):
+        """Get the values of a trial variable, in the order of the trials.
+
+        Parameters
+        ----------
+        name : str
+            The trial variable, e.g. 'TIME_PRIME'.
+        dtype : type
+            The type of the values, e.g. int.
+
+        Returns
+        -------
+        values : array, shape (n_messages,)
+            The values.
+        """
+        values = self.values[self.names == name]
+        if dtype is not str:
+            values = values.astype(dtype)
+        return values
+
+    def get_times(self, name):
+        """Get the times of the messages of a trial variable, in s."""
+        return self.times[self.names == name]
+
+    def get_trials(self, name):
+        """Get the trials of the messages of a trial variable."""
+        return self.trials[self.names == name]
+
+    def find_times(self, messages, trials):
+        """Get the times of messages, by trial.
+
+        Parameters
+        ----------
+        messages : array of str, shape (n_queries,)
+            The messages, e.g. 'TTL 1'.
+        trials : array of int, shape (n_queries,)
+            The trial of each.
+
+        Returns
+        -------
+        times : array of float, shape (n_queries,)
+            The time of the first such message of the trial, in s, or NaN
+            if there is none.
+        """
+        query = np.char.add(np.char.add(np.asarray(trials).astype(str), ' '),
+                            np.asarray(messages, str))
+        idx = np.searchsorted(self._keys, query)
+        idx = np.minimum(idx, len(self._keys) - 1)
+        found = self._keys[idx] == query
+        return np.where(found, self._key_times[idx], np.nan)
+
+    def table(self, names, dtype=str):
+        """Get the values of several trial variables, by trial.
+
+        Parameters
+        ----------
+        names : list of str
+            The trial variables.
+        dtype : type
+            The type of the values. A trial missing a variable gets 0, or
+            an empty string.
+
+        Returns
+        -------
+        trials : array of int, shape (n_trials,)
+            The trials with at least one of the variables.
+        values : dict of array, shape (n_trials,)
+            The values of each variable.
+        """
+        mask = np.isin(self.names, names)
+        trials = np.unique(self.trials[mask])
+        values = dict()
+        for name in names:
+            column = np.zeros(len(trials), self.values.dtype
+                              if dtype is str else dtype)
+            sel = self.names == name
+            column[np.searchsorted(trials, self.trials[sel])] = \
+                self.values[sel].astype(dtype)
+            values[name] = column
+        return trials, values
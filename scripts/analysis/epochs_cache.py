@@ -0,0 +1,206 @@
+"""
+Epochs Cache
+------------
+The preprocessing stages epoch the same raw around the same prime events,
+with nearly identical windows. The cache epochs a subject once, over the
+widest window the stages use and without rejection, and keeps the data in
+a `.npy` file under `derivatives/epochs_cache` of the BIDS root. The
+stages then get their window from the memory-mapped data: the crop is a
+view, and the peak-to-peak rejection is computed on the window only, so
+that the raw is read once per subject instead of once per stage.
+
+The cache is not baseline corrected, so that the stages share it whatever
+their baseline: each stage's baseline is subtracted from its window on
+retrieval. A cache entry is keyed by the event set, the decimation and the
+projectors, and is rebuilt when the raw or the events change (see
+`_rebuild`). Since it is built over the wide window, the epochs too close
+to the edges of the recording, or to a bad segment, for the wide window
+are left out even if a stage's window would have fit.
+"""
+import os
+import os.path as op
+import json
+import pickle
+import hashlib
+import numpy as np
+
+import mne
+from mne_bids.read import _handle_events_reading
+
+from _rebuild import is_stale, record
+
+
+# the widest window used by the stages
+cache_tmin, cache_tmax = -.5, 1.
+
+
+def _get_raw_fnames(bids_root, subject, task):
+    path = op.join(bids_root, f"sub-{subject}", 'meg')
+    fname_raw = op.join(path, f"sub-{subject}_task-{task}_meg.fif")
+    fname_mp_raw = op.join(path, f"sub-{subject}_task-{task}_split-01_meg.fif")
+    fname_events = op.join(path, f"sub-{subject}_task-{task}_events.tsv")
+    if not op.exists(fname_raw):
+        fname_raw = fname_mp_raw
+    return fname_raw, fname_events
+
+
+def _proj_digest(projs):
+    h = hashlib.blake2b(digest_size=20)
+    for proj in projs:
+        h.update(json.dumps(proj['data']['col_names']).encode('utf-8'))
+        h.update(np.asarray(proj['data']['data']).tobytes())
+    return h.hexdigest()
+
+
+def get_cache_fnames(bids_root, subject, task, key):
+    """Get the data and the metadata files of a cache entry."""
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8'))
+    path = op.join(bids_root, 'derivatives', 'epochs_cache', f"sub-{subject}")
+    basename = f"sub-{subject}_task-{task}_{digest.hexdigest()[:12]}"
+    return (op.join(path, basename + '_epo.npy'),
+            op.join(path, basename + '_epo.pkl'))
+
+
+def _build_cache(raw, events, event_id, decim, fname_data, fname_meta,
+                 chunk_size=50):
+    # epoch in chunks of events, so that the epochs never all are in memory
+    data = None
+    kept = list()
+    n_kept = 0
+    for start in range(0, len(events), chunk_size):
+        chunk = events[start:start + chunk_size]
+        chunk_id = {key: value for key, value in event_id.items()
+                    if value in chunk[:, 2]}
+        epochs = mne.Epochs(raw, chunk, chunk_id, tmin=cache_tmin,
+                            tmax=cache_tmax, baseline=None, reject=None,
+                            decim=decim, preload=True, verbose=False)
+        if data is None:
+            data = np.lib.format.open_memmap(
+                fname_data, mode='w+', dtype=np.float64,
+                shape=(len(events),) + epochs._data.shape[1:])
+            info, times = epochs.info, epochs.times
+        data[n_kept:n_kept + len(epochs)] = epochs._data
+        n_kept += len(epochs)
+        kept.append(epochs.events)
+    data.flush()
+    del data
+    meta = dict(info=info, times=times, events=np.concatenate(kept),
+                event_id=event_id)
+    with open(fname_meta, 'wb') as FILE:
+        pickle.dump(meta, FILE)
+
+
+def reject_epochs(data, info, reject):
+    """Find the epochs within the peak-to-peak rejection thresholds.
+
+    Parameters
+    ----------
+    data : array, shape (n_epochs, n_channels, n_times)
+        The data.
+    info : instance of Info
+        The measurement info. The bad channels are not used.
+    reject : None | dict
+        The peak-to-peak thresholds, keyed by channel type.
+
+    Returns
+    -------
+    good : array of bool, shape (n_epochs,)
+        The epochs to keep.
+    """
+    good = np.ones(len(data), bool)
+    if not reject:
+        return good
+    idx_by_type = mne.channel_indices_by_type(info)
+    bads = [info['ch_names'].index(ch) for ch in info['bads']]
+    for ch_type, thresh in reject.items():
+        idx = np.setdiff1d(idx_by_type.get(ch_type, list()), bads)
+        if len(idx):
+            good &= (np.ptp(data[:, idx], axis=-1) <= thresh).all(axis=-1)
+    return good
+
+
+def get_epochs(bids_root, subject, task, evts_labels, tmin, tmax,
+               baseline=(None, 0), reject=None, decim=1, redo=False):
+    """Get the epochs of a subject, from the cache.
+
+    Parameters
+    ----------
+    bids_root : str
+        The BIDS root.
+    subject : str
+        The subject.
+    task : str
+        The task.
+    evts_labels : list of str
+        The events to epoch around.
+    tmin, tmax : float
+        The window, within `cache_tmin` and `cache_tmax`.
+    baseline : None | tuple
+        The baseline, as in `mne.Epochs`. A None bound is the start of the
+        window, or the event.
+    reject : None | dict
+        The peak-to-peak rejection thresholds, over the window.
+    decim : int
+        The decimation.
+    redo : bool
+        If True, epoch the raw again.
+
+    Returns
+    -------
+    epochs : instance of EpochsArray
+        The epochs. If none are rejected, they are made from a view of
+        the cache.
+    """
+    if not cache_tmin <= tmin < tmax <= cache_tmax:
+        raise ValueError('The window must be within (%s, %s), not (%s, %s).'
+                         % (cache_tmin, cache_tmax, tmin, tmax))
+    fname_raw, fname_events = _get_raw_fnames(bids_root, subject, task)
+    raw = mne.io.read_raw_fif(fname_raw, verbose=False)
+    key = dict(evts_labels=sorted(evts_labels), tmin=cache_tmin,
+               tmax=cache_tmax, decim=decim,
+               projs=_proj_digest(raw.info['projs']))
+    fname_data, fname_meta = get_cache_fnames(bids_root, subject, task, key)
+
+    if is_stale([fname_data, fname_meta], [fname_raw, fname_events], key,
+                force=redo):
+        if not op.isdir(op.dirname(fname_data)):
+            os.makedirs(op.dirname(fname_data))
+        # TODO: replace with proper solution
+        raw = _handle_events_reading(fname_events, raw)
+        events, event_id = mne.events_from_annotations(raw, verbose=False)
+        event_id = {key_: value for key_, value in event_id.items()
+                    if key_ in evts_labels}
+        events = events[np.isin(events[:, 2], list(event_id.values()))]
+        if not len(events):
+            raise ValueError('None of the events %s are in %s.'
+                             % (evts_labels, fname_events))
+        _build_cache(raw, events, event_id, decim, fname_data, fname_meta)
+        record([fname_data, fname_meta], [fname_raw, fname_events], key)
+    del raw
+
+    with open(fname_meta, 'rb') as FILE:
+        meta = pickle.load(FILE)
+    n_epochs = len(meta['events'])
+    if not n_epochs:
+        raise RuntimeError('All the epochs of %s were dropped.' % subject)
+    # copy-on-write, so that in place operations do not reach the cache
+    data = np.load(fname_data, mmap_mode='c')[:n_epochs]
+    times = meta['times']
+    # the window includes both bounds, as in `Epochs.crop`
+    half = .5 / meta['info']['sfreq']
+    start, stop = np.flatnonzero((times >= tmin - half) &
+                                 (times <= tmax + half))[[0, -1]]
+    data = data[:, :, start:stop + 1]
+
+    good = reject_epochs(data, meta['info'], reject)
+    events = meta['events']
+    if not good.all():
+        data, events = data[good], events[good]
+    # EpochsArray does not take the ids of events that were all rejected
+    event_id = {key_: value for key_, value in meta['event_id'].items()
+                if value in events[:, 2]}
+    # the baseline is subtracted in place, which the copy-on-write map keeps
+    # out of the cache. A None bound is the start of the stage's window
+    return mne.EpochsArray(data, meta['info'], events=events,
+                           tmin=times[start], event_id=event_id,
+                           baseline=baseline, verbose=False)
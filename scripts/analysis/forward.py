@@ -0,0 +1,94 @@
+"""
+Forward Models
+--------------
+A forward model only depends on the geometry: the head to MRI transform,
+the source space, the BEM solution and the sensor locations. The inputs
+are hashed (see `_rebuild`), so a subject is only modeled again when one
+of them changed, and not when e.g. the epoching did.
+
+The BEM solution and the source space of a subject are read once, and used
+for the forward models of all its experiments. Experiments with the same
+sensor locations share one model.
+"""
+import os.path as op
+
+import mne
+
+import config
+from _rebuild import is_stale, record, info_digest
+
+
+mri_path = op.join(config.drive, '..', 'MRI')
+
+
+def get_fwd_fnames(subject, exp, filt=config.filt):
+    """Get the files of the forward model of a subject.
+
+    Returns
+    -------
+    fnames : dict
+        The 'epo' the sensor info is read from, the 'trans', 'src' and
+        'bem' the model is made of, and the 'fwd' itself.
+    """
+    path = op.join(config.drive, subject, 'mne')
+    return dict(epo=op.join(path, subject + '_%s_xca_calm_%s_filt-epo.fif'
+                            % (exp, filt)),
+                trans=op.join(path, subject + '-trans.fif'),
+                fwd=op.join(path, subject + '_%s-fwd.fif' % exp),
+                bem=op.join(mri_path, subject, 'bem',
+                            subject + '-inner_skull-bem-sol.fif'),
+                src=op.join(mri_path, subject, 'bem',
+                            subject + '-ico-4-src.fif'))
+
+
+def make_forwards(subject, experiments, redo=False, mindist=0.0):
+    """Make the forward models of a subject that are out of date.
+
+    Parameters
+    ----------
+    subject : str
+        The subject.
+    experiments : list of str
+        The experiments, e.g. ['OLDT', 'SENT'].
+    redo : bool
+        If True, make all the models again.
+    mindist : float
+        The minimum distance of the sources to the inner skull, in mm.
+
+    Returns
+    -------
+    made : dict
+        For each experiment, whether its model was made.
+    """
+    made = dict()
+    stale = dict()
+    for exp in experiments:
+        fnames = get_fwd_fnames(subject, exp)
+        if not op.exists(fnames['epo']):
+            continue
+        # the forward model only depends on the geometry: not on the
+        # epochs, only on the sensor locations in their info
+        info = mne.io.read_info(fnames['epo'], verbose=False)
+        inputs = [fnames['trans'], fnames['src'], fnames['bem']]
+        params = dict(sensors=info_digest(info, sensors_only=True),
+                      mindist=mindist)
+        made[exp] = is_stale(fnames['fwd'], inputs, params, force=redo)
+        if made[exp]:
+            stale[exp] = (info, fnames, inputs, params)
+    if not stale:
+        return made
+
+    fnames = get_fwd_fnames(subject, experiments[0])
+    src = mne.read_source_spaces(fnames['src'], verbose=False)
+    bem = mne.read_bem_solution(fnames['bem'], verbose=False)
+    fwds = dict()
+    for exp, (info, fnames, inputs, params) in stale.items():
+        if params['sensors'] not in fwds:
+            fwds[params['sensors']] = mne.make_forward_solution(
+                info=info, trans=fnames['trans'], src=src, bem=bem,
+                meg=True, eeg=False, mindist=mindist, ignore_ref=True,
+                verbose=False)
+        mne.write_forward_solution(fnames['fwd'], fwds[params['sensors']],
+                                   overwrite=True)
+        record(fnames['fwd'], inputs, params)
+    return made
@@ -0,0 +1,173 @@
+"""
+Generalization Across Time
+--------------------------
+`GeneralizationAcrossTime` fits a pipeline of a `StandardScaler` and a
+linear model per training time and fold, and each predicts every testing
+time. For the ridge and the logistic regressions, the fits of all the
+training times of a fold are instead solved at once: the ridge in closed
+form, the logistic regression with batched Newton (IRLS) steps, as one
+batched linear solve over the training times. The standardization is
+folded into the weights, so that the predictions of all the training times
+on all the testing times are one tensor contraction per fold.
+
+The training and testing times are all the times of the epochs, each a
+single sample, as the analyses use them.
+"""
+import numpy as np
+from scipy.special import expit
+
+from scoring import rank_scores
+
+
+def _standardize(X):
+    # as `StandardScaler`, X is of shape (n_times, n_epochs, n_features)
+    mean = X.mean(axis=1)
+    std = X.std(axis=1)
+    std[std == 0.] = 1.
+    return (X - mean[:, np.newaxis]) / std[:, np.newaxis], mean, std
+
+
+def fit_ridge(X, y, alpha=1e-3):
+    """Fit a ridge regression per time, as `Ridge`.
+
+    Parameters
+    ----------
+    X : array, shape (n_times, n_epochs, n_features)
+        The standardized data.
+    y : array, shape (n_epochs,)
+        The target.
+    alpha : float
+        The regularization.
+
+    Returns
+    -------
+    coef : array, shape (n_times, n_features)
+        The weights of each time.
+    intercept : array, shape (n_times,)
+        The intercept of each time.
+    """
+    # the standardized data are centered, so is the target
+    y_mean = y.mean()
+    X_t = X.transpose(0, 2, 1)
+    gram = X_t @ X
+    gram += alpha * np.eye(X.shape[-1])
+    rhs = X_t @ (y - y_mean)
+    coef = np.linalg.solve(gram, rhs[..., np.newaxis])[..., 0]
+    return coef, np.full(len(coef), y_mean)
+
+
+def fit_logistic(X, y, C=1., n_iter=100, tol=1e-8):
+    """Fit a logistic regression per time, as `LogisticRegression`.
+
+    The L2 penalty does not apply to the intercept.
+
+    Parameters
+    ----------
+    X : array, shape (n_times, n_epochs, n_features)
+        The standardized data.
+    y : array of int, shape (n_epochs,)
+        The classes, 0 or 1.
+    C : float
+        The inverse of the regularization.
+    n_iter : int
+        The maximum number of Newton steps.
+    tol : float
+        The largest change of a weight at convergence.
+
+    Returns
+    -------
+    coef : array, shape (n_times, n_features)
+        The weights of each time.
+    intercept : array, shape (n_times,)
+        The intercept of each time.
+    """
+    n_times, n_epochs, n_features = X.shape
+    X = np.concatenate((X, np.ones((n_times, n_epochs, 1))), axis=-1)
+    reg = np.full(n_features + 1, 1. / C)
+    reg[-1] = 0.
+    beta = np.zeros((n_times, n_features + 1))
+    X_t = X.transpose(0, 2, 1)
+    for _ in range(n_iter):
+        p = expit((X @ beta[..., np.newaxis])[..., 0])
+        grad = (X_t @ (p - y)[..., np.newaxis])[..., 0] + reg * beta
+        hess = (X_t * (p * (1. - p))[:, np.newaxis]) @ X
+        hess += np.diag(reg)
+        step = np.linalg.solve(hess, grad[..., np.newaxis])[..., 0]
+        beta -= step
+        if np.abs(step).max() < tol:
+            break
+    return beta[:, :-1], beta[:, -1]
+
+
+def accuracy_scores(y, y_preds):
+    """Score many decision values of a binary classifier."""
+    return ((y_preds > 0) == (np.ravel(y) == 1)).mean(axis=-1)
+
+
+def generalization_across_time(X, y, cv, fit, scorer, max_bytes=2 ** 28,
+                               **kwargs):
+    """Score the cross-validated generalization across time of a model.
+
+    Parameters
+    ----------
+    X : array, shape (n_epochs, n_features, n_times)
+        The data, e.g. of `epochs.get_data()`.
+    y : array, shape (n_epochs,)
+        The target.
+    cv : iterable of (train, test)
+        The folds.
+    fit : callable
+        `fit_ridge` or `fit_logistic`.
+    scorer : callable
+        The scorer of many predictions, e.g. `rank_scores` or
+        `accuracy_scores`.
+    max_bytes : int
+        The memory used by the predictions of a batch of training times.
+    **kwargs
+        The parameters of `fit`.
+
+    Returns
+    -------
+    scores : array, shape (n_train_times, n_test_times)
+        The scores, of the predictions of all the folds.
+    weights : array, shape (n_folds, n_times, n_features)
+        The weights of each fold and time, on the standardized data.
+    """
+    n_epochs, n_features, n_times = X.shape
+    y = np.asarray(y)
+    folds, weights, coefs, intercepts = list(), list(), list(), list()
+    for train, test in cv:
+        X_train, mean, std = _standardize(X[train].transpose(2, 0, 1))
+        coef, intercept = fit(X_train, y[train], **kwargs)
+        weights.append(coef)
+        # fold the standardization of each training time into its model
+        coefs.append(coef / std)
+        intercepts.append(intercept - (mean * coefs[-1]).sum(axis=-1))
+        folds.append(test)
+
+    scores = np.empty((n_times, n_times))
+    batch_size = max(1, int(max_bytes // (n_times * n_epochs * 8)))
+    for start in range(0, n_times, batch_size):
+        train_times = slice(start, start + batch_size)
+        y_pred = np.empty((len(range(n_times)[train_times]), n_times,
+                           n_epochs))
+        for test, coef, intercept in zip(folds, coefs, intercepts):
+            # (s, f) @ (t, f, e) -> (t, s, e)
+            y_pred[..., test] = (coef[train_times] @
+                                 X[test].transpose(2, 1, 0)).swapaxes(0, 1)
+            y_pred[..., test] += intercept[train_times, np.newaxis,
+                                           np.newaxis]
+        scores[train_times] = scorer(y, y_pred)
+    return scores, np.array(weights)
+
+
+def ridge_gat(X, y, cv, alpha=1e-3, scorer=rank_scores):
+    """The generalization across time of a standardized ridge regression."""
+    return generalization_across_time(X, y, cv, fit_ridge, scorer,
+                                      alpha=alpha)
+
+
+def logistic_gat(X, y, cv, C=1., scorer=accuracy_scores):
+    """The generalization across time of a standardized logistic
+    regression."""
+    return generalization_across_time(X, y, cv, fit_logistic, scorer, C=C)
@@ -0,0 +1,154 @@
+"""
+IC Scoring
+----------
+Scores the independent components for their relation to the saccades.
+
+The inter-trial coherence (ITC) of `tfr_array_morlet(..., output='itc')`
+is computed over the whole epoch, for every component and frequency, when
+only the peri-saccade window is used to rank the components. Here, the
+epochs are cut to the window, plus a wavelet length on both sides, and
+convolved with all the wavelets of a chunk of frequencies at once, by FFT.
+Only the phase average over the epochs is kept, so the complex TFR of the
+epochs is never materialized in full.
+
+The components can also be scored by their correlation with a proxy of the
+EOG, the gaze speed recorded by the eye tracker.
+"""
+import numpy as np
+from scipy.fftpack import next_fast_len
+
+from mne.time_frequency import morlet
+
+
+def windowed_itc(data, sfreq, freqs, n_cycles, start, stop, zero_mean=False,
+                 max_bytes=2 ** 28):
+    """Compute the inter-trial coherence over a window of the epochs.
+
+    The values are those of `tfr_array_morlet(..., output='itc')` over
+    `start:stop`: the convolution is zero-padded at the edges of the
+    epochs in the same way.
+
+    Parameters
+    ----------
+    data : array, shape (n_epochs, n_signals, n_times)
+        The epochs, e.g. of the ICA sources.
+    sfreq : float
+        The sampling frequency.
+    freqs : array, shape (n_freqs,)
+        The frequencies.
+    n_cycles : float | array, shape (n_freqs,)
+        The number of cycles of the wavelets.
+    start, stop : int
+        The samples of the window.
+    zero_mean : bool
+        Whether to make the wavelets zero mean.
+    max_bytes : int
+        The memory used by the convolution of one chunk of frequencies.
+
+    Returns
+    -------
+    itc : array, shape (n_signals, n_freqs, stop - start)
+        The inter-trial coherence.
+    """
+    n_epochs, n_signals, n_times = data.shape
+    Ws = morlet(sfreq, freqs, n_cycles=n_cycles, zero_mean=zero_mean)
+    n_max = max(len(W) for W in Ws)
+
+    # the window and enough samples on both sides for the longest wavelet,
+    # zero outside of the epochs
+    first, last = start - n_max, stop + n_max
+    segment = np.zeros((n_epochs, n_signals, last - first))
+    segment[..., max(-first, 0):last - first - max(last - n_times, 0)] = \
+        data[..., max(first, 0):min(last, n_times)]
+    nfft = next_fast_len(segment.shape[-1] + n_max - 1)
+    fft_segment = np.fft.fft(segment, nfft)[:, :, np.newaxis]
+    del segment
+
+    # the output at t is the full convolution at t + (len(W) - 1) // 2
+    idx = np.array([np.arange(start, stop) - first + (len(W) - 1) // 2
+                    for W in Ws])
+    n_chunk = max(1, int(max_bytes // (16 * n_epochs * n_signals * nfft)))
+    itc = np.empty((n_signals, len(Ws), stop - start))
+    for ii in range(0, len(Ws), n_chunk):
+        fft_Ws = np.array([np.fft.fft(W, nfft) for W in Ws[ii:ii + n_chunk]])
+        tfr = np.fft.ifft(fft_segment * fft_Ws, axis=-1)
+        tfr = np.take_along_axis(tfr, idx[np.newaxis, np.newaxis,
+                                          ii:ii + n_chunk], axis=-1)
+        tfr_abs = np.abs(tfr)
+        tfr_abs[tfr_abs == 0] = 1.
+        itc[:, ii:ii + n_chunk] = np.abs((tfr / tfr_abs).mean(axis=0))
+    return itc
+
+
+def itc_scores(epochs, freqs, n_cycles, tmin, tmax, **kwargs):
+    """Score signals by their inter-trial coherence over a window.
+
+    Parameters
+    ----------
+    epochs : instance of Epochs
+        The epochs, e.g. of the ICA sources.
+    freqs : array, shape (n_freqs,)
+        The frequencies.
+    n_cycles : float | array, shape (n_freqs,)
+        The number of cycles of the wavelets.
+    tmin, tmax : float
+        The window.
+    **kwargs
+        The other arguments of `windowed_itc`.
+
+    Returns
+    -------
+    scores : array, shape (n_signals,)
+        The ITC summed across the window and the frequencies.
+    """
+    start, stop = epochs.time_as_index((tmin, tmax))
+    itc = windowed_itc(epochs.get_data(), epochs.info['sfreq'], freqs,
+                       n_cycles, start, stop, **kwargs)
+    return itc.sum(axis=(1, 2))
+
+
+def gaze_speed(gaze, sfreq):
+    """Compute the gaze speed, a proxy of the EOG.
+
+    Parameters
+    ----------
+    gaze : array, shape (..., 2, n_times)
+        The horizontal and vertical gaze positions.
+    sfreq : float
+        The sampling frequency.
+
+    Returns
+    -------
+    speed : array, shape (..., n_times)
+        The speed, in units of the positions per second. The samples lost
+        by the eye tracker, NaN in the positions, are NaN.
+    """
+    velocity = np.gradient(gaze, 1. / sfreq, axis=-1)
+    return np.sqrt((velocity ** 2).sum(axis=-2))
+
+
+def eog_proxy_scores(data, proxy):
+    """Score signals by their correlation with an EOG proxy.
+
+    Parameters
+    ----------
+    data : array, shape (n_epochs, n_signals, n_times)
+        The epochs, e.g. of the ICA sources.
+    proxy : array, shape (n_epochs, n_times)
+        The proxy of the EOG on the same samples, e.g. the gaze speed.
+
+    Returns
+    -------
+    scores : array, shape (n_signals,)
+        The absolute Pearson correlations, over the samples where the proxy
+        is not NaN.
+    """
+    mask = ~np.isnan(proxy)
+    proxy = proxy[mask]
+    # data, shape (n_signals, n_samples)
+    data = data.transpose(1, 0, 2)[:, mask]
+    data = data - data.mean(axis=-1, keepdims=True)
+    proxy = proxy - proxy.mean()
+    corr = data.dot(proxy) / (np.linalg.norm(data, axis=-1) *
+                              np.linalg.norm(proxy))
+    return np.abs(corr)
@@ -0,0 +1,275 @@
+"""
+Batch ICA
+---------
+Fits the ICA of the subjects in a process pool (see `_parallel`), each
+worker with a cap on its BLAS threads.
+
+A refit is avoided or shortened when the data barely changed:
+
+    - the data of the epochs are hashed. If they are those of the saved ICA,
+      e.g. a new reject threshold did not drop any epoch, the ICA is kept.
+    - the PCA of the ICA is computed in place of `ICA.fit`, and cached by
+      the hash. FastICA is run on the data whitened by the cached PCA, and
+      the `ICA` is assembled from both. If the PCA subspace is close to the
+      one of the saved ICA, the saved unmixing matrix, mapped to the new
+      PCA, initializes FastICA.
+"""
+import os
+import os.path as op
+import json
+import hashlib
+import numpy as np
+
+import mne
+
+from _rebuild import is_stale, record
+from epochs_cache import get_epochs, _get_raw_fnames
+
+
+def get_ica_fname(bids_root, subject, task):
+    path = op.join(bids_root, f"sub-{subject}", 'meg')
+    return op.join(path, f"sub-{subject}_task-{task}_ica.fif")
+
+
+def _get_cache_path(bids_root, subject):
+    return op.join(bids_root, 'derivatives', 'ica_cache', f"sub-{subject}")
+
+
+def _get_data(epochs):
+    # the data the ICA is fitted on, shape (n_channels, n_samples)
+    picks = mne.pick_types(epochs.info, meg=True, eeg=True, ref_meg=False,
+                           exclude='bads')
+    data = epochs.get_data()[:, picks]
+    return np.hstack(data), picks
+
+
+def data_hash(epochs):
+    """Hash the data of the epochs and the channels they are on."""
+    data, picks = _get_data(epochs)
+    h = hashlib.blake2b(digest_size=20)
+    h.update(json.dumps([epochs.ch_names[pick] for pick in picks])
+             .encode('utf-8'))
+    h.update(np.ascontiguousarray(data).tobytes())
+    return h.hexdigest()
+
+
+def _standardize(data, info):
+    # the pre-whitener of `ICA.fit`: the standard deviation by channel type
+    pre_whitener = np.ones(len(data))
+    for idx in mne.channel_indices_by_type(info).values():
+        if len(idx):
+            pre_whitener[idx] = np.std(data[idx])
+    return pre_whitener
+
+
+def compute_pca(epochs):
+    """Compute the PCA of `ICA.fit`, without fitting the ICA.
+
+    The data are standardized by channel type and centered, and the signs
+    of the components are those of `ICA.fit`.
+
+    Returns
+    -------
+    pca : dict
+        The 'components', shape (n_components, n_channels), the
+        'explained_variance', shape (n_components,), and the 'mean' and
+        'pre_whitener' of the channels, shape (n_channels,).
+    """
+    data, picks = _get_data(epochs)
+    pre_whitener = _standardize(data, mne.pick_info(epochs.info, picks))
+    data /= pre_whitener[:, np.newaxis]
+    mean = data.mean(axis=1)
+    data -= mean[:, np.newaxis]
+    # the eigendecomposition of the covariance is cheaper than the SVD of
+    # the data, which has many more samples than channels
+    eigvals, eigvecs = np.linalg.eigh(data.dot(data.T))
+    order = np.argsort(eigvals)[::-1]
+    eigvals, components = eigvals[order], eigvecs[:, order].T
+    # as `svd_flip`, the largest score of each component is positive
+    scores = components.dot(data)
+    signs = np.sign(scores[np.arange(len(scores)),
+                           np.abs(scores).argmax(axis=1)])
+    components *= signs[:, np.newaxis]
+    explained_variance = np.maximum(eigvals, 0.) / (data.shape[1] - 1)
+    return dict(components=components, explained_variance=explained_variance,
+                mean=mean, pre_whitener=pre_whitener)
+
+
+def read_pca(fname, epochs):
+    """Read a cached PCA, or compute and cache it."""
+    if op.exists(fname):
+        with np.load(fname) as pca:
+            pca = dict(pca)
+        # the entries of an older cache miss the mean and the pre-whitener
+        if 'pre_whitener' in pca:
+            return pca
+    pca = compute_pca(epochs)
+    if not op.isdir(op.dirname(fname)):
+        os.makedirs(op.dirname(fname))
+    np.savez(fname, **pca)
+    return pca
+
+
+def warm_start(ica, pca, similarity=.95):
+    """Map the unmixing matrix of an ICA to a new PCA.
+
+    Parameters
+    ----------
+    ica : instance of ICA
+        The previous ICA.
+    pca : dict
+        The PCA of the new data, from `compute_pca`.
+    similarity : float
+        The smallest mean squared cosine of the principal angles between the
+        previous and the new subspaces, for the matrix to be mapped.
+
+    Returns
+    -------
+    w_init : None | array, shape (n_components, n_components)
+        The initial unmixing matrix in the new whitened PCA space, for the
+        `w_init` of FastICA. None if the subspaces differ too much.
+    """
+    n_components = ica.n_components_
+    prev = ica.pca_components_[:n_components]
+    new = pca['components'][:n_components]
+    if prev.shape != new.shape:
+        return None
+    overlap = prev.dot(new.T)
+    if np.mean(np.linalg.svd(overlap, compute_uv=False) ** 2) < similarity:
+        return None
+    # the sources are unmixing_matrix_ . prev . x, and the new whitened
+    # components are new . x / sqrt(explained_variance)
+    norms = np.sqrt(pca['explained_variance'][:n_components])
+    return ica.unmixing_matrix_.dot(overlap) * norms[np.newaxis, :]
+
+
+def _n_components(explained_variance, n_components):
+    # as `ICA.fit`, a float is the proportion of the explained variance
+    if not isinstance(n_components, float):
+        return int(n_components)
+    cvar = np.cumsum(explained_variance)
+    cvar /= cvar[-1]
+    return int(min((cvar <= n_components).sum() + 1, len(cvar)))
+
+
+def fit_from_pca(epochs, pca, n_components, random_state=None, w_init=None):
+    """Fit a FastICA on the data whitened by a precomputed PCA.
+
+    The `ICA` is that of `ICA.fit` on the epochs, without its PCA.
+
+    Parameters
+    ----------
+    epochs : instance of Epochs
+        The epochs.
+    pca : dict
+        The PCA of the epochs, from `compute_pca`.
+    n_components : int | float
+        The number of components, or the proportion of the explained
+        variance, as in `ICA`.
+    random_state : None | int
+        The seed of FastICA.
+    w_init : None | array, shape (n_components, n_components)
+        The initial unmixing matrix, from `warm_start`.
+
+    Returns
+    -------
+    ica : instance of ICA
+        The fitted ICA.
+    """
+    from sklearn.decomposition import FastICA
+
+    data, picks = _get_data(epochs)
+    data /= pca['pre_whitener'][:, np.newaxis]
+    data -= pca['mean'][:, np.newaxis]
+    if w_init is not None:
+        n_components = len(w_init)
+    n_components_ = _n_components(pca['explained_variance'], n_components)
+    norms = np.sqrt(pca['explained_variance'][:n_components_])
+    norms[norms == 0] = 1.
+    whitened = pca['components'][:n_components_].dot(data)
+    whitened /= norms[:, np.newaxis]
+    del data
+
+    # the fit parameters of the ICA are saved as JSON, so they do not take
+    # `w_init`, which only FastICA gets. `max_iter` is the 'auto' one of MNE
+    ica = mne.preprocessing.ICA(n_components=n_components, method='fastica',
+                                random_state=random_state, max_iter=1000)
+    fit_params = dict(ica.fit_params)
+    if w_init is not None:
+        fit_params['w_init'] = w_init
+    fast_ica = FastICA(whiten=False, random_state=random_state, **fit_params)
+    sources = fast_ica.fit_transform(whitened.T).T
+
+    ica.info = mne.pick_info(epochs.info, picks)
+    if ica.info['comps']:
+        with ica.info._unlock():
+            ica.info['comps'] = []
+    ica.ch_names = ica.info['ch_names']
+    ica.n_samples_ = whitened.shape[1]
+    ica.pre_whitener_ = pca['pre_whitener'][:, np.newaxis]
+    ica.pca_mean_ = pca['mean']
+    ica.pca_components_ = pca['components']
+    ica.pca_explained_variance_ = pca['explained_variance']
+    ica.n_components_ = n_components_
+    ica._update_ica_names()
+    ica.unmixing_matrix_ = fast_ica.components_ / norms[np.newaxis, :]
+    ica.n_iter_ = fast_ica.n_iter_
+    ica._update_mixing_matrix()
+    ica.reject_ = epochs.reject
+    ica.current_fit = 'epochs'
+    # as `ICA.fit`, the components are sorted by the variance they explain
+    var = (np.sum(ica.mixing_matrix_ ** 2, axis=0) *
+           np.sum(sources ** 2, axis=1))
+    order = var.argsort()[::-1]
+    ica.mixing_matrix_ = ica.mixing_matrix_[:, order]
+    ica.unmixing_matrix_ = ica.unmixing_matrix_[order]
+    return ica
+
+
+def fit_ica(subject, bids_root, task, evts_labels, tmin, tmax, reject,
+            n_components=.9, random_state=42, redo=False):
+    """Fit and save the FastICA of a subject, as cheaply as possible.
+
+    Returns
+    -------
+    how : 'unchanged' | 'reused' | 'warm' | 'fit'
+        How the ICA was obtained.
+    """
+    fname_ica = get_ica_fname(bids_root, subject, task)
+    inputs = _get_raw_fnames(bids_root, subject, task)
+    params = dict(evts_labels=evts_labels, tmin=tmin, tmax=tmax,
+                  reject=reject, n_components=n_components, method='fastica',
+                  random_state=random_state)
+    if not is_stale(fname_ica, inputs, params, force=redo):
+        return 'unchanged'
+
+    epochs = get_epochs(bids_root, subject, task, evts_labels, tmin=tmin,
+                        tmax=tmax, reject=reject)
+    digest = data_hash(epochs)
+    path = _get_cache_path(bids_root, subject)
+    fname_fit = op.join(path, f"sub-{subject}_task-{task}_ica.json")
+    fit_params = dict(n_components=n_components, random_state=random_state)
+    previous = dict()
+    if op.exists(fname_fit) and op.exists(fname_ica):
+        with open(fname_fit) as FILE:
+            previous = json.load(FILE)
+    if previous.get('hash') == digest and \
+            previous.get('params') == fit_params and not redo:
+        record(fname_ica, inputs, params)
+        return 'reused'
+
+    pca = read_pca(op.join(path, f"sub-{subject}_task-{task}_"
+                                 f"pca-{digest[:12]}.npz"), epochs)
+    how, w_init = 'fit', None
+    if previous.get('params') == fit_params and not redo:
+        w_init = warm_start(mne.preprocessing.read_ica(fname_ica), pca)
+        if w_init is not None:
+            # same subspace, same number of components
+            how = 'warm'
+    ica = fit_from_pca(epochs, pca, n_components, random_state=random_state,
+                       w_init=w_init)
+    ica.save(fname_ica, overwrite=True)
+    record(fname_ica, inputs, params)
+    with open(fname_fit, 'w') as FILE:
+        json.dump(dict(hash=digest, params=fit_params), FILE)
+    return how
@@ -0,0 +1,138 @@
+"""
+Projector Sweeps
+----------------
+Evaluates many combinations of SSP projectors on an evoked at once. The
+operator `I - U U^T` of every combination is built up front and stacked, so
+that applying all of them is a single matrix product, instead of a deep
+copy of the evoked and an `apply_proj` per combination.
+
+The combinations are:
+
+    single : each projector alone.
+    cumulative : the first 1, 2, ..., n projectors. Since the components of
+        `compute_proj_evoked` are ordered, this is the sweep over `n_mag`.
+    leave_one_out : all the projectors but one.
+"""
+from copy import deepcopy
+import numpy as np
+
+import mne
+from mne.io.proj import make_projector
+
+
+def proj_combinations(n_projs):
+    """Get the indices of the projectors in each combination.
+
+    Returns
+    -------
+    combinations : dict
+        The lists of index tuples, keyed by 'single', 'cumulative' and
+        'leave_one_out'.
+    """
+    idx = np.arange(n_projs)
+    return {'single': [(ii,) for ii in idx],
+            'cumulative': [tuple(idx[:ii + 1]) for ii in idx],
+            'leave_one_out': [tuple(np.delete(idx, ii)) for ii in idx]}
+
+
+def make_proj_operators(projs, info, combinations):
+    """Stack the projection operators of combinations of projectors.
+
+    Parameters
+    ----------
+    projs : list of Projection
+        The projectors.
+    info : instance of Info
+        The measurement info of the data to project. The bad channels are
+        left untouched, as in `apply_proj`.
+    combinations : list of tuple
+        The indices of the projectors in each operator.
+
+    Returns
+    -------
+    operators : array, shape (n_combinations, n_channels, n_channels)
+        The operators.
+    """
+    n_chan = len(info['ch_names'])
+    operators = np.empty((len(combinations), n_chan, n_chan))
+    for ii, combination in enumerate(combinations):
+        # an empty combination is the identity
+        operator = make_projector([projs[jj] for jj in combination],
+                                  info['ch_names'], bads=info['bads'])[0]
+        operators[ii] = np.eye(n_chan) if operator is None else operator
+    return operators
+
+
+def _make_info(info, projs):
+    info = info.copy()
+    projs = deepcopy(projs)
+    for proj in projs:
+        proj['active'] = True
+    unlock = getattr(info, '_unlock', None)
+    if unlock is not None:
+        with unlock():
+            info['projs'] = projs
+    else:
+        info['projs'] = projs
+    return info
+
+
+def sweep_projs(evoked, projs, kinds=('single', 'cumulative'), tmin=None,
+                tmax=None):
+    """Apply combinations of projectors to an evoked.
+
+    Parameters
+    ----------
+    evoked : instance of Evoked
+        The evoked, without the projectors applied.
+    projs : list of Projection
+        The projectors.
+    kinds : tuple of str
+        The combinations to evaluate, see `proj_combinations`.
+    tmin, tmax : None | float
+        The window over which the removed variance is computed. If None,
+        the whole evoked.
+
+    Returns
+    -------
+    evokeds : dict
+        For each kind, a list of EvokedArray, one per combination. Their
+        data are views of one array, and their info has only the
+        projectors of the combination, marked as applied.
+    removed_var : dict
+        For each kind, the fraction of the variance of the evoked removed
+        by each combination, over the good channels.
+    """
+    combinations = proj_combinations(len(projs))
+    kinds = list(kinds)
+    combinations = [combinations[kind] for kind in kinds]
+    n_combinations = [len(combination) for combination in combinations]
+    operators = make_proj_operators(projs, evoked.info,
+                                    sum(combinations, list()))
+    # data, shape (n_combinations, n_channels, n_times)
+    data = np.matmul(operators, evoked.data)
+
+    picks = mne.pick_types(evoked.info, meg=True, eeg=True, exclude='bads')
+    mask = np.ones(len(evoked.times), bool)
+    if tmin is not None:
+        mask &= evoked.times >= tmin
+    if tmax is not None:
+        mask &= evoked.times <= tmax
+    power = np.sum(evoked.data[picks][:, mask] ** 2)
+    residual = np.sum(data[:, picks][:, :, mask] ** 2, axis=(1, 2))
+    removed = 1. - residual / power
+
+    evokeds, removed_var = dict(), dict()
+    start = 0
+    for kind, combination, n in zip(kinds, combinations, n_combinations):
+        evokeds[kind] = list()
+        for ii, idx in enumerate(combination, start):
+            comment = '%s - %s' % (evoked.comment,
+                                   ', '.join(projs[jj]['desc'] for jj in idx))
+            info = _make_info(evoked.info, [projs[jj] for jj in idx])
+            evokeds[kind].append(mne.EvokedArray(
+                data[ii], info, tmin=evoked.times[0], comment=comment,
+                nave=evoked.nave, verbose=False))
+        removed_var[kind] = removed[start:start + n]
+        start += n
+    return evokeds, removed_var
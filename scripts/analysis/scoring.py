@@ -0,0 +1,101 @@
+"""
+Rank Scoring
+------------
+The regression analyses score a prediction by the proportion of the pairs
+of trials that it ranks as the truth does: the pairs whose difference has
+the same sign in `y` and in `y_pred`. A pair tied in either counts as
+wrongly ranked.
+
+Comparing all the pairs is quadratic in the number of trials. Instead, the
+pairs ranked in reverse are counted as the inversions of `y_pred` once
+sorted by `y`, with a merge sort, and the ties are counted from the runs of
+equal values (as Knight's algorithm for Kendall's tau). The merge sort is
+run on many predictions at once, e.g. all the test times of a training
+time.
+"""
+import numpy as np
+
+
+def _n_pairs(counts):
+    return counts * (counts - 1) // 2
+
+
+def _n_tied_pairs(*sorted_keys):
+    # the pairs of equal elements of arrays sorted along the last axis, equal
+    # on all the keys
+    new_run = np.zeros(sorted_keys[0].shape, bool)
+    new_run[..., 0] = True
+    for key in sorted_keys:
+        new_run[..., 1:] |= key[..., 1:] != key[..., :-1]
+    idx = np.broadcast_to(np.arange(new_run.shape[-1]), new_run.shape)
+    # the number of equal elements before each element of its run
+    run_start = np.maximum.accumulate(np.where(new_run, idx, 0), axis=-1)
+    return (idx - run_start).sum(axis=-1)
+
+
+def _count_inversions(a):
+    # the pairs i < j with a[..., i] > a[..., j], with a bottom up merge
+    # sort: the merge of two sorted halves is a stable sort of their
+    # concatenation, which finds the two runs and merges them in linear time
+    n_rows, n = a.shape
+    size = 1 << max(n - 1, 0).bit_length()
+    a = np.concatenate((a, np.full((n_rows, size - n), np.inf)), axis=1)
+    n_inversions = np.zeros(n_rows, np.int64)
+    width = 1
+    while width < size:
+        a = a.reshape(n_rows, -1, 2 * width)
+        order = np.argsort(a, axis=-1, kind='stable')
+        # the k-th element of the right half in the merge, at position p, is
+        # preceded by the p - k elements of the left half that are not
+        # greater than it
+        is_right = order >= width
+        k = np.cumsum(is_right, axis=-1) - 1
+        n_greater = width - (np.arange(2 * width) - k)
+        n_inversions += np.where(is_right, n_greater, 0).sum(axis=(1, 2))
+        a = np.take_along_axis(a, order, axis=-1).reshape(n_rows, size)
+        width *= 2
+    return n_inversions
+
+
+def rank_scores(y, y_preds):
+    """Score many predictions of the same `y`.
+
+    Parameters
+    ----------
+    y : array, shape (n_trials,)
+        The truth.
+    y_preds : array, shape (..., n_trials)
+        The predictions.
+
+    Returns
+    -------
+    scores : array, shape (...)
+        The proportion of the pairs of trials ranked as in `y`.
+    """
+    y = np.ravel(y).astype(float)
+    y_preds = np.asarray(y_preds, float)
+    shape, n = y_preds.shape[:-1], y.size
+    y_preds = y_preds.reshape(-1, n)
+    n_comb = _n_pairs(n)
+    if n_comb == 0:
+        return np.full(shape, np.nan)
+
+    # sort by y, then by y_pred
+    order = np.lexsort((y_preds, np.broadcast_to(y, y_preds.shape)), axis=-1)
+    y_sorted = y[order]
+    y_preds = np.take_along_axis(y_preds, order, axis=-1)
+    n_tied_y = _n_pairs(np.unique(y, return_counts=True)[1]).sum()
+    n_tied_pred = _n_tied_pairs(np.sort(y_preds, axis=-1))
+    n_tied_both = _n_tied_pairs(y_sorted, y_preds)
+    # the pairs tied in y are sorted by y_pred: they are not inversions
+    n_discordant = _count_inversions(y_preds)
+    n_concordant = (n_comb - n_tied_y - n_tied_pred + n_tied_both -
+                    n_discordant)
+    return (n_concordant / float(n_comb)).reshape(shape)
+
+
+def rank_scorer(y, y_pred):
+    """Score a prediction, see `rank_scores`."""
+    # because of dimensionality issues with the output of sklearn regression
+    # one needs to ravel
+    return rank_scores(y, np.ravel(y_pred))[()]
@@ -0,0 +1,374 @@
+"""
+Source Projection
+-----------------
+Applying an inverse operator is a matrix product with the imaging kernel
+of the operator, but `apply_inverse_epochs` prepares the operator and
+assembles the kernel once per call, and makes a `SourceEstimate` of every
+epoch. Here the kernel is assembled once per subject and number of
+averages, and the epochs are streamed through it in batches, as one
+`np.matmul` per batch, into a float32 `.npy` store of shape
+(n_epochs, n_sources, n_times) that is memory-mapped on read. The times,
+vertices and events of the store are kept in a `.npz` next to it.
+
+The stores can be morphed to a template brain. The morph matrix only
+depends on the source space, so it is computed once per subject and
+cached, and is only computed again when the source space changes (see
+`_rebuild`).
+"""
+import json
+import hashlib
+import os.path as op
+import numpy as np
+from scipy import sparse
+
+import mne
+from mne.io.constants import FIFF
+from mne.minimum_norm import prepare_inverse_operator, read_inverse_operator
+from mne.minimum_norm.inverse import (_assemble_kernel, _check_ch_names,
+                                      _subject_from_inverse,
+                                      _pick_channels_inverse_operator)
+
+import config
+from _rebuild import is_stale, record
+from forward import mri_path, get_fwd_fnames
+
+
+# the usual regularization: an SNR of 3 for the evokeds, 1 for the epochs
+lambda2_evoked = 1. / 3. ** 2
+lambda2_epochs = 1.
+method = 'dSPM'
+subject_to = 'fsaverage'
+
+
+def get_stc_fnames(subject, exp, kind, filt=config.filt):
+    """Get the files of a source store of a subject.
+
+    Parameters
+    ----------
+    subject : str
+        The subject.
+    exp : str
+        The experiment, e.g. 'OLDT'.
+    kind : str
+        What was projected: 'epo', or the name of the analysis of the rERF
+        evokeds.
+
+    Returns
+    -------
+    fnames : dict
+        The 'data' and the 'meta' of the store, the 'morph_data' and the
+        'morph_meta' of the store morphed to the template, and the 'morph'
+        matrix of the subject.
+    """
+    path = op.join(config.drive, subject, 'mne')
+    basename = subject + '_%s_calm_%s_filt_%s' % (exp, filt, kind)
+    return dict(data=op.join(path, basename + '-stc.npy'),
+                meta=op.join(path, basename + '-stc.npz'),
+                morph_data=op.join(path, basename + '_%s-stc.npy'
+                                   % subject_to),
+                morph_meta=op.join(path, basename + '_%s-stc.npz'
+                                   % subject_to),
+                morph=op.join(path, subject + '_%s-morph.npz' % subject_to))
+
+
+class InverseKernel(object):
+    """The imaging kernels of an inverse operator.
+
+    Parameters
+    ----------
+    inv : instance of InverseOperator
+        The inverse operator, as read.
+    lambda2 : float
+        The regularization parameter.
+    method : 'MNE' | 'dSPM' | 'sLORETA' | 'eLORETA'
+        The inverse method.
+    pick_ori : None | 'normal'
+        If None, the free orientations are combined into their norm.
+    """
+    def __init__(self, inv, lambda2=lambda2_evoked, method=method,
+                 pick_ori=None):
+        self.inv = inv
+        self.lambda2 = lambda2
+        self.method = method
+        self.pick_ori = pick_ori
+        self.is_free_ori = (inv['source_ori'] == FIFF.FIFFV_MNE_FREE_ORI and
+                            pick_ori != 'normal')
+        self.vertices = [s['vertno'] for s in inv['src']]
+        self.subject = _subject_from_inverse(inv)
+        # the kernels depend on the number of averages, through the noise
+        # covariance
+        self._kernels = dict()
+
+    @property
+    def n_sources(self):
+        return sum(len(vertno) for vertno in self.vertices)
+
+    def get(self, nave):
+        """Get the kernel and the noise normalization for `nave`."""
+        if nave not in self._kernels:
+            inv = prepare_inverse_operator(self.inv, nave, self.lambda2,
+                                           self.method, verbose=False)
+            K, noise_norm, _, _ = _assemble_kernel(inv, None, self.method,
+                                                   self.pick_ori)
+            self._kernels[nave] = (K, noise_norm)
+        return self._kernels[nave]
+
+    def picks(self, info):
+        """Get the channels of `info` the kernel applies to."""
+        _check_ch_names(self.inv, info)
+        return _pick_channels_inverse_operator(info['ch_names'], self.inv)
+
+    def apply(self, data, nave=1):
+        """Project a batch of sensor data to the sources.
+
+        Parameters
+        ----------
+        data : array, shape (n_epochs, n_channels, n_times)
+            The data of the channels of the kernel, see `picks`.
+        nave : int
+            The number of averages of the data.
+
+        Returns
+        -------
+        sol : array, shape (n_epochs, n_sources, n_times)
+            The source time courses, in float32.
+        """
+        K, noise_norm = self.get(nave)
+        sol = np.matmul(K, data)
+        if self.is_free_ori:
+            # as `combine_xyz`, the norm of the x, y and z components
+            sol = sol.reshape(len(sol), -1, 3, sol.shape[-1])
+            sol = np.sqrt(np.einsum('ijkl,ijkl->ijl', sol, sol))
+        if noise_norm is not None:
+            sol *= noise_norm
+        return sol.astype(np.float32)
+
+    def batch_size(self, n_times, max_bytes=2 ** 28):
+        """Get the number of epochs whose solution fits in `max_bytes`."""
+        K, _ = self.get(1)
+        return max(1, int(max_bytes // (K.shape[0] * n_times * 8)))
+
+
+def _write_meta(fname, kernel, tmin, sfreq, **kwargs):
+    np.savez(fname, lh_vertno=kernel.vertices[0],
+             rh_vertno=kernel.vertices[1], tmin=tmin, sfreq=sfreq,
+             subject=kernel.subject, method=kernel.method,
+             lambda2=kernel.lambda2, **kwargs)
+
+
+def project_epochs(epochs, kernel, fname_data, fname_meta, max_bytes=2 ** 28):
+    """Project epochs to the sources, batch by batch, into a store.
+
+    Parameters
+    ----------
+    epochs : instance of Epochs
+        The epochs. They do not need to be preloaded: only a batch is in
+        memory at a time.
+    kernel : instance of InverseKernel
+        The kernel, made with the regularization of single epochs.
+    fname_data : str
+        The `.npy` file of the store.
+    fname_meta : str
+        The `.npz` file of the times, vertices and events of the store.
+    max_bytes : int
+        The memory used by the solution of a batch, before the orientations
+        are combined.
+    """
+    picks = kernel.picks(epochs.info)
+    n_epochs, n_times = len(epochs.events), len(epochs.times)
+    data = np.lib.format.open_memmap(
+        fname_data, mode='w+', dtype=np.float32,
+        shape=(n_epochs, kernel.n_sources, n_times))
+    batch_size = kernel.batch_size(n_times, max_bytes)
+    for start in range(0, n_epochs, batch_size):
+        item = np.arange(start, min(start + batch_size, n_epochs))
+        batch = epochs.get_data(item=item)[:, picks]
+        data[item] = kernel.apply(batch, nave=1)
+    data.flush()
+    del data
+    _write_meta(fname_meta, kernel, epochs.tmin, epochs.info['sfreq'],
+                events=epochs.events, event_id=json.dumps(epochs.event_id))
+
+
+def project_evokeds(evokeds, kernel, fname_data, fname_meta):
+    """Project evokeds, e.g. the rERFs of an analysis, into a store.
+
+    The evokeds are projected with the kernel of their number of averages,
+    and must have the same times.
+    """
+    picks = kernel.picks(evokeds[0].info)
+    data = np.lib.format.open_memmap(
+        fname_data, mode='w+', dtype=np.float32,
+        shape=(len(evokeds), kernel.n_sources, len(evokeds[0].times)))
+    naves = np.array([evoked.nave for evoked in evokeds])
+    for nave in np.unique(naves):
+        idx = np.where(naves == nave)[0]
+        batch = np.array([evokeds[ii].data[picks] for ii in idx])
+        data[idx] = kernel.apply(batch, nave=nave)
+    data.flush()
+    del data
+    _write_meta(fname_meta, kernel, evokeds[0].times[0],
+                evokeds[0].info['sfreq'], nave=naves,
+                comments=json.dumps([evoked.comment for evoked in evokeds]))
+
+
+def read_stc_store(fname_data, fname_meta, mmap_mode='r'):
+    """Read a source store.
+
+    Returns
+    -------
+    data : memmap, shape (n_items, n_sources, n_times)
+        The source time courses of the epochs or evokeds.
+    meta : dict
+        The 'vertices', 'tmin', 'tstep' and 'subject' of the source
+        estimates, and the 'events' and 'event_id' of epochs, or the
+        'nave' and 'comments' of evokeds.
+    """
+    data = np.load(fname_data, mmap_mode=mmap_mode)
+    with np.load(fname_meta) as FILE:
+        meta = dict(FILE)
+    meta['vertices'] = [meta.pop('lh_vertno'), meta.pop('rh_vertno')]
+    meta['tstep'] = 1. / float(meta.pop('sfreq'))
+    for key in ('tmin', 'lambda2'):
+        meta[key] = float(meta[key])
+    for key in ('subject', 'method'):
+        meta[key] = str(meta[key])
+    for key in ('event_id', 'comments'):
+        if key in meta:
+            meta[key] = json.loads(str(meta[key]))
+    return data, meta
+
+
+def get_stc(data, meta, idx):
+    """Make the `SourceEstimate` of an item of a store."""
+    return mne.SourceEstimate(np.asarray(data[idx]), meta['vertices'],
+                              tmin=meta['tmin'], tstep=meta['tstep'],
+                              subject=meta['subject'])
+
+
+def get_morph(subject, inv, spacing=5, redo=False):
+    """Get the morph matrix of a subject to the template, cached.
+
+    Returns
+    -------
+    morph_mat : sparse matrix, shape (n_sources_to, n_sources)
+        The morph matrix.
+    vertices_to : list of array
+        The vertices of the template.
+    """
+    fname = get_stc_fnames(subject, config.exp, 'epo')['morph']
+    fname_src = get_fwd_fnames(subject, config.exp)['src']
+    h = hashlib.blake2b(digest_size=20)
+    for s in inv['src']:
+        h.update(np.asarray(s['vertno']).tobytes())
+    params = dict(vertices=h.hexdigest(), subject_to=subject_to,
+                  spacing=spacing)
+    if is_stale(fname, [fname_src], params, force=redo):
+        morph = mne.compute_source_morph(
+            inv['src'], subject_from=subject, subject_to=subject_to,
+            spacing=spacing, subjects_dir=mri_path, verbose=False)
+        morph_mat = sparse.csr_matrix(morph.morph_mat)
+        np.savez(fname, data=morph_mat.data, indices=morph_mat.indices,
+                 indptr=morph_mat.indptr, shape=morph_mat.shape,
+                 lh_vertno=morph.vertices_to[0],
+                 rh_vertno=morph.vertices_to[1])
+        record(fname, [fname_src], params)
+    with np.load(fname) as FILE:
+        morph_mat = sparse.csr_matrix((FILE['data'], FILE['indices'],
+                                       FILE['indptr']), shape=FILE['shape'])
+        vertices_to = [FILE['lh_vertno'], FILE['rh_vertno']]
+    return morph_mat, vertices_to
+
+
+def morph_store(morph_mat, vertices_to, fnames, max_bytes=2 ** 28):
+    """Morph a store to the template, batch by batch.
+
+    The `fnames` are those of `get_stc_fnames`.
+    """
+    data, _ = read_stc_store(fnames['data'], fnames['meta'])
+    n_items, n_sources, n_times = data.shape
+    morphed = np.lib.format.open_memmap(
+        fnames['morph_data'], mode='w+', dtype=np.float32,
+        shape=(n_items, morph_mat.shape[0], n_times))
+    batch_size = max(1, int(max_bytes // (morph_mat.shape[0] * n_times * 4)))
+    for start in range(0, n_items, batch_size):
+        batch = data[start:start + batch_size]
+        # one sparse product for the batch: the items are side by side
+        batch = batch.transpose(1, 0, 2).reshape(n_sources, -1)
+        batch = morph_mat.dot(batch).reshape(morph_mat.shape[0], -1, n_times)
+        morphed[start:start + batch_size] = batch.transpose(1, 0, 2)
+    morphed.flush()
+    del morphed
+    with np.load(fnames['meta']) as FILE:
+        meta = dict(FILE)
+    meta.update(lh_vertno=vertices_to[0], rh_vertno=vertices_to[1],
+                subject=subject_to)
+    np.savez(fnames['morph_meta'], **meta)
+
+
+def make_stcs(subject, exp, analyses, morph=True, redo=False):
+    """Make the source stores of a subject that are out of date.
+
+    Parameters
+    ----------
+    subject : str
+        The subject.
+    exp : str
+        The experiment, e.g. 'OLDT'.
+    analyses : list of str
+        The analyses whose rERF evokeds are projected.
+    morph : bool
+        If True, the stores are morphed to the template as well.
+    redo : bool
+        If True, make all the stores again.
+
+    Returns
+    -------
+    made : dict
+        For the epochs ('epo') and each analysis, whether its store was
+        made.
+    """
+    path = op.join(config.drive, subject, 'mne')
+    fname_inv = op.join(path, subject + '_%s-inv.fif' % exp)
+    fname_epo = get_fwd_fnames(subject, exp)['epo']
+    fname_rerf = op.join(path, subject + '_%s_calm_%s_filt_%s_rerf-ave.fif')
+    sources = dict(epo=(fname_epo, lambda2_epochs))
+    for analysis in analyses:
+        sources[analysis] = (fname_rerf % (exp, config.filt, analysis),
+                             lambda2_evoked)
+
+    made = dict()
+    kernels = dict()
+    morph_mat = None
+    for kind, (fname, lambda2) in sources.items():
+        if not op.exists(fname):
+            continue
+        fnames = get_stc_fnames(subject, exp, kind)
+        outputs = [fnames['data'], fnames['meta']]
+        if morph:
+            outputs += [fnames['morph_data'], fnames['morph_meta']]
+        inputs = [fname_inv, fname]
+        params = dict(method=method, lambda2=lambda2, morph=morph,
+                      subject_to=subject_to if morph else None)
+        made[kind] = is_stale(outputs, inputs, params, force=redo)
+        if not made[kind]:
+            continue
+
+        if lambda2 not in kernels:
+            if not kernels:
+                inv = read_inverse_operator(fname_inv, verbose=False)
+            kernels[lambda2] = InverseKernel(inv, lambda2=lambda2)
+        if kind == 'epo':
+            epochs = mne.read_epochs(fname, preload=False, verbose=False)
+            project_epochs(epochs, kernels[lambda2], fnames['data'],
+                           fnames['meta'])
+        else:
+            evokeds = mne.read_evokeds(fname, verbose=False)
+            project_evokeds(evokeds, kernels[lambda2], fnames['data'],
+                            fnames['meta'])
+        if morph:
+            if morph_mat is None:
+                morph_mat, vertices_to = get_morph(subject, inv, redo=redo)
+            morph_store(morph_mat, vertices_to, fnames)
+        record(outputs, inputs, params)
+    return made